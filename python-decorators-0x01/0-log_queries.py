@@ -1,26 +1,158 @@
 import sqlite3
-from datetime import datetime
 import functools
+import inspect
 import logging
+import atexit
+import hashlib
+import json
+import queue
+import random
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from query_cache import normalize_sql
 
-# Configure logging to log to a file
-logging.basicConfig(
-   level=logging.INFO, 
-   format='%(asctime)s - %(levelname)s - %(message)s', 
-   handlers=[
-       logging.FileHandler('db_queries.log'),
-       logging.StreamHandler()
-   ],
-)
-
-def log_queries(func):
-  @functools.wraps(func)  # Preserve the original function's name and docstring
-  def wrapper(*args, **kwargs):
-    query = kwargs.get('query') or (args[0] if args else "")
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    logging.info(f"Executing query: {query} at {timestamp}")
-    return func(*args, **kwargs)    
-  return wrapper
+# String and number literals, replaced by ? in query fingerprints
+_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# Helper modules the decorators call through, e.g. SingleFlight.do() of @cache_query
+_DECORATOR_MODULES = frozenset({'query_cache', 'connection_pool'})
+
+
+class QueryLogFormatter(logging.Formatter):
+  # Records logged by log_queries(structured=True) become one JSON object per line,
+  # everything else keeps the text format
+  def format(self, record):
+    event = getattr(record, 'query_event', None)
+    if event is None:
+      return super().format(record)
+    return json.dumps({'time': self.formatTime(record), 'level': record.levelname, **event}, default=str)
+
+
+class _ListenerQueueHandler(QueueHandler):
+  # Hand records over unformatted, so formatting and JSON encoding run on the
+  # listener thread along with the file and console writes
+  def prepare(self, record):
+    return record
+
+
+# Configure logging to log to a file and the console. The calling thread only puts
+# records on a queue; query_log_listener formats and writes them on its own thread.
+_formatter = QueryLogFormatter('%(asctime)s - %(levelname)s - %(message)s')
+_handlers = [logging.FileHandler('db_queries.log'), logging.StreamHandler()]
+for _handler in _handlers:
+  _handler.setFormatter(_formatter)
+_log_queue = queue.SimpleQueue()
+query_log_listener = QueueListener(_log_queue, *_handlers, respect_handler_level=True)
+query_log_listener.start()
+atexit.register(query_log_listener.stop)
+
+logging.basicConfig(level=logging.INFO, handlers=[_ListenerQueueHandler(_log_queue)])
+query_logger = logging.getLogger('db_queries')
+
+@functools.lru_cache(maxsize=4096)
+def query_fingerprint(query):
+  # Queries differing only in formatting or literal values share a fingerprint
+  normalized = _LITERAL_PATTERN.sub('?', normalize_sql(query))
+  return normalized, hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+def _call_site(frame):
+  # Walk up past the decorator wrappers, recognized as closures over the decorated
+  # func (this module's and the ones stacked around it, e.g. with_db_connection),
+  # and the helper modules they call through, to the code that made the call
+  while frame is not None and ('func' in frame.f_code.co_freevars
+                               or frame.f_globals.get('__name__') in _DECORATOR_MODULES):
+    frame = frame.f_back
+  return frame
+
+def _query_of(args, kwargs):
+  return kwargs.get('query') or (args[0] if args else "")
+
+def log_queries(_func=None, *, structured=False, slow_ms=None, sample_rate=None, logger=query_logger):
+  # Log the query (the 'query' argument, or the first one) of every call.
+  #
+  # By default each call logs "Executing query: ..." before it runs. With structured=True
+  # each call is logged after it returns as a JSON record with the query fingerprint,
+  # duration, rows returned and caller. Calls taking at least slow_ms milliseconds are
+  # always logged, as warnings; sample_rate is the fraction of the other calls logged,
+  # by default all of them without slow_ms and none of them with it.
+  # Usable bare (@log_queries) or with options (@log_queries(structured=True, slow_ms=50)).
+  fast_rate = (1.0 if slow_ms is None else 0.0) if sample_rate is None else sample_rate
+  slow_seconds = None if slow_ms is None else slow_ms / 1000
+  timed = structured or slow_ms is not None
+
+  def decorator_log_queries(func):
+    def finish(query, sampled, started, result, error):
+      duration = time.perf_counter() - started
+      slow = slow_seconds is not None and duration >= slow_seconds
+      if not (slow or sampled):
+        return
+      level = logging.WARNING if slow else logging.INFO
+      if not structured:
+        logger.log(level, "Slow query (%.1f ms): %s" if slow else "Executed query (%.1f ms): %s",
+                   duration * 1000, query)
+        return
+      caller = _call_site(sys._getframe())
+      normalized, fingerprint = query_fingerprint(str(query))
+      logger.log(level, "query", extra={'query_event': {
+        'fingerprint': fingerprint,
+        'query': normalized,
+        'duration_ms': round(duration * 1000, 3),
+        'rows': len(result) if isinstance(result, (list, tuple)) else None,
+        'function': func.__qualname__,
+        'caller': f"{caller.f_code.co_filename}:{caller.f_lineno} in {caller.f_code.co_name}" if caller else None,
+        'slow': slow,
+        'error': repr(error) if error is not None else None,
+      }})
+
+    def sample():
+      return fast_rate >= 1 or random.random() < fast_rate
+
+    # Coroutine functions get an async wrapper, so the decorators stacked on
+    # top of this one still see a coroutine function
+    if inspect.iscoroutinefunction(func):
+      @functools.wraps(func)
+      async def async_wrapper(*args, **kwargs):
+        query, sampled = _query_of(args, kwargs), sample()
+        if not timed:
+          if sampled:
+            logger.info("Executing query: %s", query)
+          return await func(*args, **kwargs)
+        started = time.perf_counter()
+        result = error = None
+        try:
+          result = await func(*args, **kwargs)
+          return result
+        except Exception as e:
+          error = e
+          raise
+        finally:
+          finish(query, sampled, started, result, error)
+      return async_wrapper
+
+    @functools.wraps(func)  # Preserve the original function's name and docstring
+    def wrapper(*args, **kwargs):
+      query, sampled = _query_of(args, kwargs), sample()
+      if not timed:
+        if sampled:
+          logger.info("Executing query: %s", query)
+        return func(*args, **kwargs)
+      started = time.perf_counter()
+      result = error = None
+      try:
+        result = func(*args, **kwargs)
+        return result
+      except Exception as e:
+        error = e
+        raise
+      finally:
+        finish(query, sampled, started, result, error)
+    return wrapper
+
+  if _func is None:
+    return decorator_log_queries
+  else:
+    return decorator_log_queries(_func)
 
 def populate_db():
     conn = sqlite3.connect('users.db')
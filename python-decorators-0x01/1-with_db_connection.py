@@ -1,27 +1,55 @@
+import inspect
 import sqlite3
 import functools
 from typing import Callable, Any
+from connection_pool import AsyncSQLitePool, SQLitePool, async_connect, get_async_pool, get_pool
 
 
-def with_db_connection(func: Callable) -> Callable:
+def with_db_connection(_func: Callable | None = None, *,
+                       pool: SQLitePool | AsyncSQLitePool | bool = False) -> Callable:
     """
     A decorator that opens a SQLite database connection and closes it automatically.
 
+    With pool=True the connection is borrowed from the shared pool (see connection_pool.configure())
+    and handed back after the call, instead of being opened and closed on every call.
+    Coroutine functions get an aiosqlite connection (from the shared async pool with pool=True).
+
     Args:
-        func: The function to be passed to the decorator.
+        _func: The function to be passed to the decorator, when used without arguments.
+        pool: True to use the shared pool, or a SQLitePool (AsyncSQLitePool for coroutine
+            functions) to borrow connections from.
 
     Returns:
         The wrapped function with an active database connection passed as an argument.
     """
-    @functools.wraps(func)
-    def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn=conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper_connect
+    def decorator_with_db_connection(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+                if pool:
+                    async with (get_async_pool() if pool is True else pool).connection() as conn:
+                        return await func(conn=conn, *args, **kwargs)
+                async with async_connect('users.db') as conn:
+                    return await func(conn=conn, *args, **kwargs)
+            return async_wrapper_connect
+
+        @functools.wraps(func)
+        def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+            if pool:
+                with (get_pool() if pool is True else pool).connection() as conn:
+                    return func(conn=conn, *args, **kwargs)
+            conn = sqlite3.connect('users.db')
+            try:
+                result = func(conn=conn, *args, **kwargs)
+            finally:
+                conn.close()
+            return result
+        return wrapper_connect
+
+    if _func is None:
+        return decorator_with_db_connection
+    else:
+        return decorator_with_db_connection(_func)
 
 @with_db_connection
 def get_user_by_id(conn: sqlite3.Connection, user_id: int) -> tuple | None:
@@ -1,51 +1,301 @@
+import contextlib
 import sqlite3
+import inspect
 import functools
-from typing import Callable, Any
+import threading
+import time
+from typing import Callable, Any, Iterator
+from connection_pool import AsyncSQLitePool, SQLitePool, async_connect, get_async_pool, get_pool
+from query_cache import CacheBackend, cache_call, get_shared_cache, written_tables
 
-def with_db_connection(func: Callable) -> Callable:
+def with_db_connection(_func: Callable | None = None, *,
+                       pool: SQLitePool | AsyncSQLitePool | bool = False) -> Callable:
     """
     A decorator that opens a SQLite database connection and closes it automatically.
 
+    With pool=True the connection is borrowed from the shared pool (see connection_pool.configure())
+    and handed back after the call, instead of being opened and closed on every call.
+    Coroutine functions get an aiosqlite connection (from the shared async pool with pool=True).
+
     Args:
-        func: The function to be passed to the decorator.
+        _func: The function to be passed to the decorator, when used without arguments.
+        pool: True to use the shared pool, or a SQLitePool (AsyncSQLitePool for coroutine
+            functions) to borrow connections from.
 
     Returns:
         The wrapped function with an active database connection passed as an argument.
     """
-    @functools.wraps(func)
-    def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
-        conn = sqlite3.connect('users.db')
+    def decorator_with_db_connection(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+                if pool:
+                    async with (get_async_pool() if pool is True else pool).connection() as conn:
+                        return await func(conn=conn, *args, **kwargs)
+                async with async_connect('users.db') as conn:
+                    return await func(conn=conn, *args, **kwargs)
+            return async_wrapper_connect
+
+        @functools.wraps(func)
+        def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+            batch = current_batch()
+            if batch is not None:
+                # Inside batched_transaction() every call shares the batch's connection
+                return func(conn=batch.conn, *args, **kwargs)
+            if pool:
+                with (get_pool() if pool is True else pool).connection() as conn:
+                    return func(conn=conn, *args, **kwargs)
+            conn = sqlite3.connect('users.db')
+            try:
+                result = func(conn=conn, *args, **kwargs)
+            finally:
+                conn.close()
+            return result
+        return wrapper_connect
+
+    if _func is None:
+        return decorator_with_db_connection
+    else:
+        return decorator_with_db_connection(_func)
+
+
+class TransactionBatch:
+    """
+    Group commit state of a batched_transaction() scope.
+
+    Each operation runs inside its own savepoint, so a failing operation
+    only rolls back its own changes. The enclosing transaction is committed
+    once max_ops operations are pending or max_delay_ms milliseconds have
+    passed since the first of them; the delay is checked as operations
+    complete.
+
+    Attributes:
+        conn (sqlite3.Connection): The connection shared by the operations of the batch.
+        pending (int): Operations run since the last commit.
+        commits (int): Number of commits made.
+        failed (int): Number of operations rolled back to their savepoint.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_ops: int, max_delay_ms: float):
+        """
+        Initialize a batch on a connection.
+
+        Args:
+            conn: The connection the operations run on.
+            max_ops: Pending operations that trigger a commit.
+            max_delay_ms: Milliseconds after the first pending operation that trigger a commit.
+        """
+        self.conn = conn
+        self.max_ops = max_ops
+        self.max_delay = max_delay_ms / 1000
+        self.pending = 0
+        self.commits = 0
+        self.failed = 0
+        self._started_at = 0.0
+        self._written: dict[int, tuple[CacheBackend, set]] = {}
+
+    def run(self, func: Callable, cache: CacheBackend, *args: Any, **kwargs: Any) -> Any:
+        """
+        Run one operation in a savepoint, committing the batch when it is due.
+
+        Args:
+            func: The operation, called with the batch's connection first.
+            cache: The cache to invalidate for the tables the operation writes.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            The result of func.
+        """
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+            self._started_at = time.monotonic()
+        written = set()
+
+        def trace(statement: str) -> None:
+            written.update(written_tables(statement))
+
+        conn.set_trace_callback(trace)
+        conn.execute("SAVEPOINT batch_operation")
         try:
-            result = func(conn=conn, *args, **kwargs)
+            result = func(conn, *args, **kwargs)
+        except BaseException as e:
+            # Also on KeyboardInterrupt, so the batch never holds half an operation
+            print(f"Error processing request: {e}")
+            conn.execute("ROLLBACK TO batch_operation")
+            conn.execute("RELEASE batch_operation")
+            self.failed += 1
+            raise
         finally:
-            conn.close()
+            conn.set_trace_callback(None)
+        conn.execute("RELEASE batch_operation")
+
+        self.pending += 1
+        self._written.setdefault(id(cache), (cache, set()))[1].update(written)
+        if self.pending >= self.max_ops or time.monotonic() - self._started_at >= self.max_delay:
+            self.commit()
         return result
-    return wrapper_connect
+
+    def commit(self) -> None:
+        """Commit the pending operations and invalidate the cached results of the tables they wrote."""
+        if self.conn.in_transaction:
+            self.conn.commit()
+        if self.pending:
+            self.commits += 1
+        self.pending = 0
+        written, self._written = self._written, {}
+        for cache, tables in written.values():
+            cache.invalidate_tables(tables)
+
+    def rollback(self) -> None:
+        """Roll back the operations run since the last commit."""
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        self.pending = 0
+        self._written = {}
 
 
-def transactional(func: Callable) -> Callable:
+_batch_state = threading.local()
+
+
+def current_batch() -> TransactionBatch | None:
+    """
+    Return the batch of the batched_transaction() active in this thread.
+
+    Returns:
+        The active TransactionBatch, or None.
+    """
+    return getattr(_batch_state, 'batch', None)
+
+
+@contextlib.contextmanager
+def batched_transaction(max_ops: int = 1000, max_delay_ms: float = 100,
+                        pool: SQLitePool | bool = False,
+                        rollback_on_error: bool = False) -> Iterator[TransactionBatch]:
+    """
+    Group the @transactional calls made in this thread into a few large commits.
+
+    Inside the scope, @with_db_connection passes every call the same connection
+    and @transactional runs each call in a savepoint instead of committing it,
+    so thousands of small writes cost a handful of fsyncs. Operations still pending
+    when the scope ends are committed, even if it ends with an exception: a failing
+    operation has already been rolled back to its savepoint, and the ones that
+    succeeded are kept. Pass rollback_on_error=True to discard every operation since
+    the last commit instead; those committed by max_ops or max_delay_ms stay committed.
+    Can also be used as a decorator, e.g. @batched_transaction(max_ops=500).
+    Batching is for synchronous functions only; coroutine functions keep
+    their own aiosqlite connection and commit on every call.
+
+    Args:
+        max_ops: Commit after this many operations. Defaults to 1000.
+        max_delay_ms: Commit once the oldest pending operation is this many milliseconds old. Defaults to 100.
+        pool: True to borrow the connection from the shared pool, or a SQLitePool.
+        rollback_on_error: Roll back the pending operations if the scope ends with an exception.
+            Defaults to False.
+
+    Yields:
+        The TransactionBatch, e.g. to read its commits and failed counters.
+
+    Raises:
+        RuntimeError: If a batched transaction is already active in this thread.
+    """
+    if current_batch() is not None:
+        raise RuntimeError("A batched transaction is already active in this thread.")
+    with contextlib.ExitStack() as stack:
+        if pool:
+            conn = stack.enter_context((get_pool() if pool is True else pool).connection())
+        else:
+            conn = sqlite3.connect('users.db')
+            stack.callback(conn.close)
+        batch = TransactionBatch(conn, max_ops, max_delay_ms)
+        _batch_state.batch = batch
+        try:
+            yield batch
+        except BaseException:
+            if rollback_on_error:
+                batch.rollback()
+            else:
+                try:
+                    batch.commit()
+                except Exception:
+                    batch.rollback()  # the scope's own error is the one to report
+            raise
+        else:
+            batch.commit()
+        finally:
+            _batch_state.batch = None
+
+
+def transactional(_func: Callable | None = None, *, cache: CacheBackend | None = None) -> Callable:
     """
         A decorator that manages database transactions by automatically committing or rolling back changes.
 
+        The statements run inside the transaction are traced, and once it commits, the cached
+        results of every table it wrote to are invalidated. Inside batched_transaction() the
+        call runs in a savepoint of the batch instead and is committed with it.
+        Coroutine functions are given an aiosqlite connection and awaited the same way.
+
         Args:
-            func: Function to be passed to the decorator.
+            _func: Function to be passed to the decorator, when used without arguments.
+            cache: The cache to invalidate. Defaults to the cache shared with @cache_query.
 
         Returns:
             The wrapped function.
 
     """
+    def decorator_transactional(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(conn: Any, *args: Any, **kwargs: Any) -> Any:
+                written = set()
 
-    @functools.wraps(func)
-    def wrapper(conn: sqlite3.Connection, *args: Any, **kwargs: Any) -> Any:
-        try:
-            result = func(conn, *args, **kwargs)
-            conn.commit()
+                def trace(statement: str) -> None:
+                    written.update(written_tables(statement))
+
+                await conn.set_trace_callback(trace)
+                try:
+                    result = await func(conn, *args, **kwargs)
+                    await conn.commit()
+                except Exception as e:
+                    print(f"Error processing request: {e}")
+                    await conn.rollback()
+                    raise
+                finally:
+                    await conn.set_trace_callback(None)
+                store = cache if cache is not None else get_shared_cache()
+                await cache_call(store, store.invalidate_tables, written)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(conn: sqlite3.Connection, *args: Any, **kwargs: Any) -> Any:
+            batch = current_batch()
+            if batch is not None and batch.conn is conn:
+                return batch.run(func, cache if cache is not None else get_shared_cache(), *args, **kwargs)
+            written = set()
+
+            def trace(statement: str) -> None:
+                written.update(written_tables(statement))
+
+            conn.set_trace_callback(trace)
+            try:
+                result = func(conn, *args, **kwargs)
+                conn.commit()
+            except Exception as e:
+                print(f"Error processing request: {e}")
+                conn.rollback()
+                raise
+            finally:
+                conn.set_trace_callback(None)
+            (cache if cache is not None else get_shared_cache()).invalidate_tables(written)
             return result
-        except Exception as e:
-            print(f"Error processing request: {e}")
-            conn.rollback()
-            raise
-    return wrapper
+        return wrapper
+
+    if _func is None:
+        return decorator_transactional
+    else:
+        return decorator_transactional(_func)
 
 
 @with_db_connection
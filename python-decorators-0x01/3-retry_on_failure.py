@@ -1,7 +1,12 @@
 import time
+import random
+import asyncio
 import sqlite3
+import inspect
 import functools
+import threading
 from typing import Callable, Any
+from connection_pool import AsyncSQLitePool, SQLitePool, async_connect, get_async_pool, get_pool
 
 class RetryFailedException(Exception):
     """
@@ -25,32 +30,217 @@ class RetryFailedException(Exception):
         print(f"{self.original_exception}".upper())
 
 
-def with_db_connection(func: Callable) -> Callable:
+def with_db_connection(_func: Callable | None = None, *,
+                       pool: SQLitePool | AsyncSQLitePool | bool = False) -> Callable:
     """
     A decorator that opens a SQLite database connection and closes it automatically.
 
+    With pool=True the connection is borrowed from the shared pool (see connection_pool.configure())
+    and handed back after the call, instead of being opened and closed on every call.
+    Coroutine functions get an aiosqlite connection (from the shared async pool with pool=True).
+
     Args:
-        func: The function to be passed to the decorator.
+        _func: The function to be passed to the decorator, when used without arguments.
+        pool: True to use the shared pool, or a SQLitePool (AsyncSQLitePool for coroutine
+            functions) to borrow connections from.
 
     Returns:
         Callable: The wrapped function with an active database connection passed as an argument.
     """
-    @functools.wraps(func)
-    def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn=conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper_connect
-
-def retry_on_failure(retries: int, delay: int) -> Callable:
+    def decorator_with_db_connection(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+                if pool:
+                    async with (get_async_pool() if pool is True else pool).connection() as conn:
+                        return await func(conn=conn, *args, **kwargs)
+                async with async_connect('users.db') as conn:
+                    return await func(conn=conn, *args, **kwargs)
+            return async_wrapper_connect
+
+        @functools.wraps(func)
+        def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+            if pool:
+                with (get_pool() if pool is True else pool).connection() as conn:
+                    return func(conn=conn, *args, **kwargs)
+            conn = sqlite3.connect('users.db')
+            try:
+                result = func(conn=conn, *args, **kwargs)
+            finally:
+                conn.close()
+            return result
+        return wrapper_connect
+
+    if _func is None:
+        return decorator_with_db_connection
+    else:
+        return decorator_with_db_connection(_func)
+
+def is_retryable(exception: Exception) -> bool:
     """
+    Default retry classifier: only transient lock contention is worth retrying.
 
     Args:
-        retries: Maximum number of retry attempts before giving up.
-        delay: Delay in seconds between attempts.
+        exception: The exception raised by an attempt.
+
+    Returns:
+        True for sqlite3.OperationalError "database is locked" / "busy" errors, False
+        for everything else, such as syntax errors or missing tables.
+    """
+    if not isinstance(exception, sqlite3.OperationalError):
+        return False
+    message = str(exception).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class RetryBudget:
+    """
+    Process-wide token bucket limiting how many retries may be made.
+
+    Every retry spends one token. Tokens are earned back at ratio per
+    successful call and min_per_second per second, up to capacity. During an
+    outage the bucket empties and calls fail fast instead of multiplying the
+    load on the database.
+
+    Attributes:
+        capacity (float): Maximum number of stored tokens.
+        ratio (float): Tokens earned per successful call.
+        min_per_second (float): Tokens earned per second regardless of traffic.
+    """
+
+    def __init__(self, capacity: float = 10.0, ratio: float = 0.1, min_per_second: float = 1.0):
+        """
+        Initialize a full budget.
+
+        Args:
+            capacity: Maximum number of stored tokens. Defaults to 10.
+            ratio: Tokens earned per successful call, i.e. retries allowed per call. Defaults to 0.1.
+            min_per_second: Tokens earned per second. Defaults to 1.
+        """
+        self.capacity = capacity
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_success(self) -> None:
+        """Earn back ratio tokens for a successful call."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Take one token for a retry.
+
+        Returns:
+            True if the retry may go ahead, False if the budget is exhausted.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        """The tokens currently available."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RetryMetrics:
+    """
+    Counters of the attempts made by @retry_on_failure functions.
+
+    Attributes:
+        attempts (int): Calls of the decorated functions, including retries.
+        retries (int): Attempts made after a failure.
+        successes (int): Calls that eventually succeeded.
+        failures (int): Calls that gave up.
+        non_retryable (int): Failures the classifier refused to retry.
+        budget_exhausted (int): Retries refused by the retry budget.
+    """
+
+    def __init__(self):
+        """Initialize all counters to zero."""
+        self._lock = threading.Lock()
+        self.attempts = self.retries = self.successes = self.failures = 0
+        self.non_retryable = self.budget_exhausted = 0
+
+    def count(self, **counts: int) -> None:
+        """
+        Add to counters by name.
+
+        Args:
+            **counts: Amounts to add, e.g. attempts=1.
+        """
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        """
+        Report the counters.
+
+        Returns:
+            A dict of every counter.
+        """
+        with self._lock:
+            return {name: getattr(self, name) for name in
+                    ('attempts', 'retries', 'successes', 'failures', 'non_retryable', 'budget_exhausted')}
+
+
+# Shared by every @retry_on_failure function unless one is given its own
+retry_budget = RetryBudget()
+retry_metrics = RetryMetrics()
+
+
+def backoff_delay(attempt: int, delay: float, max_delay: float, backoff: float = 2.0, jitter: bool = True) -> float:
+    """
+    Compute the sleep before the next attempt.
+
+    Args:
+        attempt: Number of failed attempts so far, starting at 1.
+        delay: Base delay in seconds.
+        max_delay: Cap of the delay in seconds.
+        backoff: Growth factor per attempt. Defaults to 2.
+        jitter: Draw the delay uniformly between 0 and the cap ("full jitter"), so that
+            clients failing together do not retry together. Defaults to True.
+
+    Returns:
+        The delay in seconds.
+    """
+    ceiling = min(max_delay, delay * backoff ** (attempt - 1))
+    return random.uniform(0, ceiling) if jitter else ceiling
+
+
+def retry_on_failure(retries: int, delay: float, *, max_delay: float = 30.0, backoff: float = 2.0,
+                     jitter: bool = True, retry_on: Callable[[Exception], bool] = is_retryable,
+                     budget: RetryBudget | None = retry_budget, metrics: RetryMetrics = retry_metrics,
+                     on_attempt: Callable[..., None] | None = None) -> Callable:
+    """
+
+    Args:
+        retries: Maximum number of attempts before giving up.
+        delay: Base delay in seconds, doubled (backoff) after every failed attempt.
+        max_delay: Cap of the delay between attempts in seconds. Defaults to 30.
+        backoff: Growth factor of the delay. Defaults to 2.
+        jitter: Sleep a random time up to the delay (full jitter). Defaults to True.
+        retry_on: Classifier deciding whether an exception is worth retrying. Defaults to is_retryable.
+        budget: RetryBudget every retry must take a token from, None for no limit.
+            Defaults to the process-wide retry_budget.
+        metrics: RetryMetrics to count attempts in. Defaults to the process-wide retry_metrics.
+        on_attempt: Called after every attempt as on_attempt(func_name, attempt, exception, duration),
+            with exception None on success.
 
     Returns:
         Callable: The wrapped function with retry logic.
@@ -58,7 +248,9 @@ def retry_on_failure(retries: int, delay: int) -> Callable:
     def transactional(func: Callable) -> Callable:
         """
             A decorator that manages database transactions, committing on success and rolling back on failure.
-            Retries the function up to 'retries' times in case of exceptions.
+            Retries the function up to 'retries' times when the classifier accepts the exception
+            and the retry budget allows it. Coroutine functions are awaited and back off
+            with asyncio.sleep, so other tasks keep running while they wait.
 
             Args:
                 func: Function to be passed to the decorator.
@@ -68,22 +260,79 @@ def retry_on_failure(retries: int, delay: int) -> Callable:
 
         """
 
+        def failed(attempt: int, exception: Exception, started: float) -> float | None:
+            # Shared by both loops: report the attempt, then either re-raise or pick the next pause
+            if on_attempt:
+                on_attempt(func.__name__, attempt, exception, time.perf_counter() - started)
+            if not retry_on(exception):
+                metrics.count(failures=1, non_retryable=1)
+                raise exception
+            if attempt == retries:
+                return None
+            if budget is not None and not budget.try_spend():
+                metrics.count(failures=1, budget_exhausted=1)
+                raise RetryFailedException("Retry budget exhausted, not retrying", exception)
+            pause = backoff_delay(attempt, delay, max_delay, backoff, jitter)
+            print(f"Error processing request retrying in {pause:.2f} seconds...")
+            return pause
+
+        def succeeded(attempt: int, started: float) -> None:
+            if on_attempt:
+                on_attempt(func.__name__, attempt, None, time.perf_counter() - started)
+            metrics.count(successes=1)
+            if budget is not None:
+                budget.record_success()
+
+        def exhausted(last_exception: Exception | None) -> RetryFailedException:
+            metrics.count(failures=1)
+            return RetryFailedException(f"Max retries({retries}) reached persistent errors in retry", last_exception)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(conn: Any, *args: Any, **kwargs: Any) -> Any:
+                last_exception = None
+                for attempt in range(1, retries + 1):
+                    print("Attempting to process request...", attempt)
+                    metrics.count(attempts=1, retries=int(attempt > 1))
+                    started = time.perf_counter()
+                    try:
+                        result = await func(conn, *args, **kwargs)
+                        await conn.commit()
+                    except Exception as e:
+                        await conn.rollback()
+                        last_exception = e
+                        pause = failed(attempt, e, started)
+                        if pause is None:
+                            break
+                        await asyncio.sleep(pause)
+                        continue
+                    succeeded(attempt, started)
+                    return result
+                raise exhausted(last_exception)
+
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(conn: sqlite3.Connection, *args: Any, **kwargs: Any) -> Any:
             last_exception = None
-            for attempt in range(retries):
-                print("Attempting to process request...", attempt + 1)
+            for attempt in range(1, retries + 1):
+                print("Attempting to process request...", attempt)
+                metrics.count(attempts=1, retries=int(attempt > 1))
+                started = time.perf_counter()
                 try:
                     result = func(conn, *args, **kwargs)
                     conn.commit()
-                    return result
                 except Exception as e:
                     conn.rollback()
                     last_exception = e
-                    print(f"Error processing request retrying in {delay} seconds...")
-                    time.sleep(delay)
-            else:
-                raise RetryFailedException(f"Max retries({retries}) reached persistent errors in retry", last_exception)    
+                    pause = failed(attempt, e, started)
+                    if pause is None:
+                        break
+                    time.sleep(pause)
+                    continue
+                succeeded(attempt, started)
+                return result
+            raise exhausted(last_exception)
 
         return wrapper
     return transactional
@@ -3,64 +3,232 @@ import time
 import sqlite3 
 import functools
 from typing import Callable, Any
+from connection_pool import AsyncSQLitePool, SQLitePool, async_connect, get_async_pool, get_pool
+from query_cache import (MISSING, AsyncSingleFlight, CacheBackend, SingleFlight, async_make_key, cache_call,
+                         get_shared_cache, make_key, tables_in)
 
 
-query_cache = {}
+# Bounded LRU cache shared by every @cache_query function; entries expire after 5 minutes
+# and are invalidated when @transactional (2-transactional.py) commits a write to their tables.
+# query_cache.set_shared_cache(DiskCache(path)) switches every decorator to an on-disk cache
+# shared by all the processes of a host.
+query_cache = get_shared_cache()
 
-def with_db_connection(func: Callable) -> Callable:
+def with_db_connection(_func: Callable | None = None, *,
+                       pool: SQLitePool | AsyncSQLitePool | bool = False) -> Callable:
     """
     A decorator that opens a SQLite database connection and closes it automatically.
 
+    With pool=True the connection is borrowed from the shared pool (see connection_pool.configure())
+    and handed back after the call, instead of being opened and closed on every call.
+    Coroutine functions get an aiosqlite connection (from the shared async pool with pool=True).
+
     Args:
-        func: The function to be passed to the decorator.
+        _func: The function to be passed to the decorator, when used without arguments.
+        pool: True to use the shared pool, or a SQLitePool (AsyncSQLitePool for coroutine
+            functions) to borrow connections from.
 
     Returns:
         Callable: The wrapped function with an active database connection passed as an argument.
     """
-    @functools.wraps(func)
-    def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn=conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper_connect
-
-
-def cache_query(func: Callable) -> Callable:
+    def decorator_with_db_connection(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+                if pool:
+                    async with (get_async_pool() if pool is True else pool).connection() as conn:
+                        return await func(conn=conn, *args, **kwargs)
+                async with async_connect('users.db') as conn:
+                    return await func(conn=conn, *args, **kwargs)
+            return async_wrapper_connect
+
+        @functools.wraps(func)
+        def wrapper_connect(*args: Any, **kwargs: Any) -> Any:
+            if pool:
+                with (get_pool() if pool is True else pool).connection() as conn:
+                    return func(conn=conn, *args, **kwargs)
+            conn = sqlite3.connect('users.db')
+            try:
+                result = func(conn=conn, *args, **kwargs)
+            finally:
+                conn.close()
+            return result
+        return wrapper_connect
+
+    if _func is None:
+        return decorator_with_db_connection
+    else:
+        return decorator_with_db_connection(_func)
+
+
+def cache_query(_func: Callable | None = None, *, ttl: float | None = MISSING,
+                cache: CacheBackend | None = None, stale_while_revalidate: float = 0) -> Callable:
     """
     Decorator that caches query results to avoid repeated database calls for the same query.
 
+    Can be used bare (@cache_query) or with options (@cache_query(ttl=60)).
+    Results are keyed on the database file, the normalized query and the other
+    arguments of the call, so the same query with different parameters gets its
+    own entry while formatting differences share one. A result is not cached if
+    a write invalidated one of its tables while the query was running.
+
+    Concurrent misses for the same key are coalesced: one call runs the query
+    while the others wait for its result. With stale_while_revalidate, a result
+    that expired less than that many seconds ago is still returned immediately
+    while a single background thread refreshes it on its own connection.
+    Coroutine functions are coalesced per event loop and refreshed by a
+    background task on a new aiosqlite connection.
+
     Args:
-        func: The function to decorate.
+        _func: The function to decorate, when used without arguments.
+        ttl: Time to live in seconds of this function's results. Defaults to the cache's ttl.
+        cache: The cache backend (e.g. a QueryCache or DiskCache) to store results in.
+            Defaults to the shared cache.
+        stale_while_revalidate: Seconds an expired result may still be served
+            while it is refreshed. Defaults to 0 (never serve stale results).
 
     Returns:
         Callable: The wrapped function with an active database connection passed as an argument.
 
     """
-    # Inspect the function signature and bound argument names with their parameters
-    sig = inspect.signature(func)
-
-    @functools.wraps(func)
-    def wrapper(*args: Any, **kwargs: Any) -> Any:
-        bound = sig.bind(*args, **kwargs)
-        bound.apply_defaults()
+    def decorator_cache_query(func: Callable) -> Callable:
+        # Inspect the function signature and bound argument names with their parameters
+        sig = inspect.signature(func)
+        namespace = f"{func.__module__}.{func.__qualname__}"
+        flights = SingleFlight()
 
-        # Get the key query from the arguments dictionary
-        query = bound.arguments.get("query")
-        if query is None:
-            raise ValueError("The 'query' parameter must be provided for caching.")
+        def store_result(store: CacheBackend, key: tuple, query: str, result: Any, generation: Any) -> None:
+            # The generation, taken before the query ran, drops results a concurrent write made stale
+            if not stale_while_revalidate:
+                store.set(key, result, ttl, tables=tables_in(query), generation=generation)
+                return
+            fresh_ttl = store.ttl if ttl is MISSING else ttl
+            if fresh_ttl is None:
+                store.set(key, (result, float('inf')), None, tables=tables_in(query), generation=generation)
+            else:
+                # Keep the entry past its freshness deadline so it can be served while refreshing
+                store.set(key, (result, time.time() + fresh_ttl), fresh_ttl + stale_while_revalidate,
+                          tables=tables_in(query), generation=generation)
 
-        if query not in query_cache:
-            print("Putting in cache...")
+        def refresh(store: CacheBackend, key: tuple, query: str, bound: inspect.BoundArguments) -> None:
+            # The caller's connection is closed by now, so open one on the same database file
+            conn = sqlite3.connect(key[0])
             try:
-                query_cache[query] = func(*args, **kwargs)
+                bound.arguments['conn'] = conn
+                generation = store.generation(tables_in(query))
+                store_result(store, key, query, func(*bound.args, **bound.kwargs), generation)
             except Exception as e:
-                print(f"Error processing: {e}")
-                raise
-        return query_cache[query]
-    return wrapper
+                print(f"Error refreshing cache: {e}")
+            finally:
+                conn.close()
+
+        def bind(args: tuple, kwargs: dict) -> tuple[CacheBackend, str, dict, Any]:
+            store = cache if cache is not None else get_shared_cache()
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            # Get the key query from the arguments dictionary
+            query = bound.arguments.get("query")
+            if query is None:
+                raise ValueError("The 'query' parameter must be provided for caching.")
+
+            params = {name: value for name, value in bound.arguments.items() if name not in ('conn', 'query')}
+            return store, query, params, bound.arguments.get('conn')
+
+        def stale_arguments(args: tuple, kwargs: dict) -> inspect.BoundArguments:
+            stale = sig.bind(*args, **kwargs)
+            stale.apply_defaults()
+            return stale
+
+        if inspect.iscoroutinefunction(func):
+            async_flights = AsyncSingleFlight()
+
+            async def async_refresh(store: CacheBackend, key: tuple, query: str,
+                                    bound: inspect.BoundArguments) -> None:
+                try:
+                    async with async_connect(key[0]) as conn:
+                        bound.arguments['conn'] = conn
+                        generation = await cache_call(store, store.generation, tables_in(query))
+                        result = await func(*bound.args, **bound.kwargs)
+                        await cache_call(store, store_result, store, key, query, result, generation)
+                except Exception as e:
+                    print(f"Error refreshing cache: {e}")
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                store, query, params, conn = bind(args, kwargs)
+                key = await async_make_key(conn, query, params, namespace)
+                if key is None:
+                    return await func(*args, **kwargs)
+
+                # The cache calls run on a worker thread for DiskCache, so its file
+                # locks never block the event loop
+                async def load() -> Any:
+                    cached = await cache_call(store, lambda: store.get(key) if key in store else MISSING)
+                    if cached is not MISSING:
+                        return cached
+                    print("Putting in cache...")
+                    generation = await cache_call(store, store.generation, tables_in(query))
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        print(f"Error processing: {e}")
+                        raise
+                    await cache_call(store, store_result, store, key, query, result, generation)
+                    return (result, float('inf')) if stale_while_revalidate else result
+
+                cached = await cache_call(store, store.get, key)
+                if cached is MISSING:
+                    cached = await async_flights.do(key, load)
+                if not stale_while_revalidate:
+                    return cached
+                result, fresh_until = cached
+                if fresh_until <= time.time() and 'conn' in sig.parameters:
+                    stale = stale_arguments(args, kwargs)
+                    async_flights.do_in_background(key, lambda: async_refresh(store, key, query, stale))
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            store, query, params, conn = bind(args, kwargs)
+            key = make_key(conn, query, params, namespace)
+            if key is None:
+                return func(*args, **kwargs)
+
+            def load() -> Any:
+                # Another flight may have filled the entry just before this one started
+                if key in store:
+                    cached = store.get(key)
+                    if cached is not MISSING:
+                        return cached
+                print("Putting in cache...")
+                generation = store.generation(tables_in(query))
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    print(f"Error processing: {e}")
+                    raise
+                store_result(store, key, query, result, generation)
+                return (result, float('inf')) if stale_while_revalidate else result
+
+            cached = store.get(key)
+            if cached is MISSING:
+                cached = flights.do(key, load)
+            if not stale_while_revalidate:
+                return cached
+            # Entries of this function are stored as (result, fresh until) pairs
+            result, fresh_until = cached
+            if fresh_until <= time.time() and 'conn' in sig.parameters:
+                stale = stale_arguments(args, kwargs)
+                flights.do_in_background(key, lambda: refresh(store, key, query, stale))
+            return result
+        return wrapper
+
+    if _func is None:
+        return decorator_cache_query
+    else:
+        return decorator_cache_query(_func)
 
 
 @with_db_connection
@@ -86,4 +254,5 @@ print(users)
 
 #### Second call will use the cached result
 users_again = fetch_users_with_cache(query="SELECT * FROM users")
-print(users_again)
\ No newline at end of file
+print(users_again)
+print(query_cache.stats())
\ No newline at end of file
@@ -0,0 +1,527 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Iterator
+
+try:
+    import aiosqlite
+except ImportError:  # aiosqlite is only needed by the async decorators
+    aiosqlite = None
+
+# Applied to every new connection. WAL lets readers run alongside a writer and,
+# with synchronous=NORMAL, commits no longer wait for an fsync of the database file.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative sizes are in KiB, so 64 MiB of page cache
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """A sqlite3 connection that, unlike the base class, supports weak references."""
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class SQLitePool:
+    """
+    Pool of reusable SQLite connections with PRAGMAs applied once per connection.
+
+    Reusing connections keeps the parsed schema and the page cache warm
+    across calls. Connections idle for longer than health_check_interval are
+    checked with SELECT 1 before being handed out and replaced if broken.
+    After a fork the child starts with an empty pool instead of sharing the
+    parent's connections.
+
+    With thread_local=True each thread keeps one connection of its own for
+    its whole life, and size is not enforced. Otherwise at most size
+    connections are shared by all threads, and a connection is used by one
+    thread at a time. Either way close() closes every connection the pool
+    opened, in all threads: idle ones at once, borrowed ones when released.
+
+    Attributes:
+        path (str): The database file.
+        size (int): Maximum number of connections in the shared pool.
+    """
+
+    def __init__(self, path: str = 'users.db', size: int = 5, pragmas: dict | None = None,
+                 timeout: float = 30.0, health_check_interval: float = 30.0,
+                 thread_local: bool = False, **connect_args: Any):
+        """
+        Initialize an empty pool; connections are opened on first use.
+
+        Args:
+            path: The database file. Defaults to 'users.db'.
+            size: Maximum number of shared connections. Defaults to 5.
+            pragmas: PRAGMAs applied to new connections. Defaults to DEFAULT_PRAGMAS.
+            timeout: Seconds to wait for a free connection, also used as SQLite's busy timeout. Defaults to 30.
+            health_check_interval: Idle seconds after which a connection is checked before reuse. Defaults to 30.
+            thread_local: Give each thread its own connection instead of sharing size connections.
+            **connect_args: Extra arguments for sqlite3.connect(). Connections are
+                PooledConnection objects unless a factory is given.
+        """
+        self.path = path
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.thread_local = thread_local
+        self.connect_args = connect_args
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle: list[tuple[sqlite3.Connection, float]] = []
+        self._in_use = 0
+        self._local = threading.local()
+        # Every open connection (weakly, so a dead thread's connection can still be
+        # collected), the borrowed ones, and those close() left for release() to close
+        self._connections: weakref.WeakSet = weakref.WeakSet()
+        self._borrowed: set[sqlite3.Connection] = set()
+        self._doomed: set[sqlite3.Connection] = set()
+        self._epoch = 0
+        self.created = 0
+        self.replaced = 0
+
+    def _check_fork(self) -> None:
+        # Connections must not be shared between processes; drop the parent's without closing them
+        if self._pid != os.getpid():
+            with self._condition:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def _open(self) -> sqlite3.Connection:
+        connect_args = {'factory': PooledConnection, **self.connect_args}
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, **connect_args)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._condition:
+            self.created += 1
+        return conn
+
+    def _borrow(self, conn: sqlite3.Connection) -> None:
+        # Called with the condition held, so close() sees the connection as either idle or borrowed
+        with contextlib.suppress(TypeError):  # a custom factory may not support weak references
+            self._connections.add(conn)
+        self._borrowed.add(conn)
+
+    def _healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Take a connection from the pool, opening one if the pool is not full.
+
+        Returns:
+            A connection reserved for the caller until release().
+
+        Raises:
+            PoolTimeout: If every connection stays in use for timeout seconds.
+        """
+        self._check_fork()
+        if self.thread_local:
+            conn = getattr(self._local, 'conn', None)
+            depth = getattr(self._local, 'depth', 0)
+            if depth:
+                # Nested calls on one thread share its connection, which is only checked when not in use
+                self._local.depth = depth + 1
+                return conn
+            with self._condition:
+                if conn is not None and self._local.epoch != self._epoch:
+                    conn = self._local.conn = None  # closed by close()
+                if conn is not None:
+                    self._borrow(conn)
+            if conn is None or (time.monotonic() - self._local.used_at > self.health_check_interval
+                                and not self._healthy(conn)):
+                if conn is not None:
+                    self.replaced += 1
+                    with self._condition:
+                        self._borrowed.discard(conn)
+                conn = self._open()
+                with self._condition:
+                    self._borrow(conn)
+                    self._local.epoch = self._epoch
+                self._local.conn = conn
+            self._local.depth = 1
+            return conn
+
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No connection to {self.path} available after {self.timeout}s")
+                self._condition.wait(remaining)
+            self._in_use += 1
+            idle = self._idle.pop() if self._idle else None
+            if idle is not None:
+                self._borrow(idle[0])
+        try:
+            if idle is not None:
+                conn, released_at = idle
+                if time.monotonic() - released_at <= self.health_check_interval or self._healthy(conn):
+                    return conn
+                with self._condition:
+                    self._borrowed.discard(conn)
+                conn.close()
+                self.replaced += 1
+            conn = self._open()
+            with self._condition:
+                self._borrow(conn)
+            return conn
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """
+        Return a connection taken with acquire(), rolling back any open transaction.
+
+        Args:
+            conn: The connection to give back.
+        """
+        if self.thread_local:
+            self._local.depth -= 1
+            if self._local.depth:
+                return  # still used by an outer call on this thread
+
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            healthy = False
+
+        if self._pid != os.getpid():
+            return
+        with self._condition:
+            self._borrowed.discard(conn)
+            if conn in self._doomed:
+                self._doomed.discard(conn)
+                healthy = False  # the pool was closed while it was borrowed
+            if not self.thread_local:
+                self._in_use -= 1
+                if healthy:
+                    # LIFO, so the most recently used (warmest) connection is reused first
+                    self._idle.append((conn, time.monotonic()))
+                self._condition.notify()
+
+        if self.thread_local:
+            self._local.used_at = time.monotonic()
+            if not healthy:
+                self._local.conn = None
+        if not healthy:
+            conn.close()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for the duration of a with block.
+
+        Yields:
+            A pooled connection.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self) -> dict:
+        """
+        Report the pool usage.
+
+        Returns:
+            A dict with the in-use and idle counts and the number of connections created and replaced.
+        """
+        with self._condition:
+            return {'in_use': self._in_use, 'idle': len(self._idle),
+                    'created': self.created, 'replaced': self.replaced}
+
+    def close(self) -> None:
+        """
+        Close every connection the pool opened, in all threads.
+
+        Idle connections, including other threads' thread-local ones, are closed
+        at once; borrowed ones are closed when they are released. The pool can
+        still be used afterwards and opens new connections.
+        """
+        with self._condition:
+            self._epoch += 1
+            idle = [conn for conn, _ in self._idle]
+            self._idle = []
+            idle += [conn for conn in self._connections if conn not in self._borrowed]
+            self._doomed |= self._borrowed
+            self._connections = weakref.WeakSet()
+        local = getattr(self._local, 'conn', None)
+        if local is not None and not getattr(self._local, 'depth', 0):
+            idle.append(local)  # not tracked if the factory does not support weak references
+            self._local.conn = None
+        for conn in idle:
+            conn.close()
+
+
+def async_connect(path: str = 'users.db', **kwargs: Any) -> Any:
+    """
+    Open an aiosqlite connection, for use as "async with async_connect(path) as conn".
+
+    Args:
+        path: The database file. Defaults to 'users.db'.
+        **kwargs: Extra arguments for aiosqlite.connect().
+
+    Returns:
+        The aiosqlite connection, awaitable and usable as an async context manager.
+
+    Raises:
+        ImportError: If aiosqlite is not installed.
+    """
+    if aiosqlite is None:
+        raise ImportError("aiosqlite is required to decorate coroutine functions")
+    return aiosqlite.connect(path, **kwargs)
+
+
+class AsyncSQLitePool:
+    """
+    Asyncio counterpart of SQLitePool, handing out aiosqlite connections.
+
+    Waiting for a free connection suspends the task instead of blocking the
+    event loop. A pool must only be used from one event loop; get_async_pool()
+    keeps one per loop.
+
+    Every aiosqlite connection runs on a non-daemon thread, so the pool must be
+    closed before the interpreter can exit: use "async with pool:", await close(),
+    or get the pool from get_async_pool(), which closes it when the loop shuts
+    down its async generators (asyncio.run() does).
+
+    Attributes:
+        path (str): The database file.
+        size (int): Maximum number of open connections.
+    """
+
+    def __init__(self, path: str = 'users.db', size: int = 5, pragmas: dict | None = None,
+                 timeout: float = 30.0, health_check_interval: float = 30.0, **connect_args: Any):
+        """
+        Initialize an empty pool; connections are opened on first use.
+
+        Args:
+            path: The database file. Defaults to 'users.db'.
+            size: Maximum number of connections. Defaults to 5.
+            pragmas: PRAGMAs applied to new connections. Defaults to DEFAULT_PRAGMAS.
+            timeout: Seconds to wait for a free connection, also used as SQLite's busy timeout. Defaults to 30.
+            health_check_interval: Idle seconds after which a connection is checked before reuse. Defaults to 30.
+            **connect_args: Extra arguments for aiosqlite.connect().
+        """
+        self.path = path
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_args = connect_args
+        self._idle: list[tuple[Any, float]] = []
+        self._slots: asyncio.Semaphore | None = None
+        self._in_use = 0
+        self._closed = False
+        self.created = 0
+        self.replaced = 0
+
+    async def _open(self) -> Any:
+        conn = await async_connect(self.path, timeout=self.timeout, **self.connect_args)
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name}={value}")
+        self.created += 1
+        return conn
+
+    async def _healthy(self, conn: Any) -> bool:
+        try:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+            return True
+        except (sqlite3.Error, ValueError):
+            return False
+
+    async def acquire(self) -> Any:
+        """
+        Take a connection from the pool, opening one if the pool is not full.
+
+        Returns:
+            An aiosqlite connection reserved for the caller until release().
+
+        Raises:
+            PoolTimeout: If every connection stays in use for timeout seconds.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No connection to {self.path} available after {self.timeout}s") from None
+        self._in_use += 1
+        try:
+            if self._idle:
+                conn, released_at = self._idle.pop()
+                if time.monotonic() - released_at <= self.health_check_interval or await self._healthy(conn):
+                    return conn
+                await conn.close()
+                self.replaced += 1
+            return await self._open()
+        except BaseException:
+            self._in_use -= 1
+            self._slots.release()
+            raise
+
+    async def release(self, conn: Any) -> None:
+        """
+        Return a connection taken with acquire(), rolling back any open transaction.
+
+        Args:
+            conn: The connection to give back.
+        """
+        try:
+            if self._closed:
+                await conn.close()
+                return
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.append((conn, time.monotonic()))
+        except (sqlite3.Error, ValueError):
+            await conn.close()
+        finally:
+            self._in_use -= 1
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        """
+        Borrow a connection for the duration of an async with block.
+
+        Yields:
+            A pooled aiosqlite connection.
+        """
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    def metrics(self) -> dict:
+        """
+        Report the pool usage.
+
+        Returns:
+            A dict with the in-use and idle counts and the number of connections created and replaced.
+        """
+        return {'in_use': self._in_use, 'idle': len(self._idle),
+                'created': self.created, 'replaced': self.replaced}
+
+    async def close(self) -> None:
+        """Close the idle connections; connections still in use are closed when released."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await conn.close()
+
+    async def __aenter__(self) -> 'AsyncSQLitePool':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def close_soon(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Schedule close() on the pool's event loop, from any thread.
+
+        Args:
+            loop: The event loop the pool is used from.
+        """
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(lambda: loop.create_task(self.close()))
+
+
+_pool = None
+_pool_settings = {}
+_pool_lock = threading.Lock()
+_async_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncSQLitePool]' = weakref.WeakKeyDictionary()
+
+
+def configure(**kwargs: Any) -> None:
+    """
+    Set the arguments of the shared pool, e.g. configure(path='users.db', size=10).
+
+    Args:
+        **kwargs: Arguments for SQLitePool. The current shared pool is closed and
+            a new one is created on next use.
+    """
+    global _pool
+    with _pool_lock:
+        _pool_settings.update(kwargs)
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        # New async pools pick up the settings; the discarded ones are closed on their loops
+        for loop, pool in list(_async_pools.items()):
+            pool.close_soon(loop)
+        _async_pools.clear()
+
+
+def get_pool() -> SQLitePool:
+    """
+    Return the shared pool, creating it on first use.
+
+    Returns:
+        The SQLitePool used by @with_db_connection(pool=True).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SQLitePool(**_pool_settings)
+        return _pool
+
+
+def get_async_pool() -> AsyncSQLitePool:
+    """
+    Return the shared async pool of the running event loop, creating it on first use.
+
+    Returns:
+        The AsyncSQLitePool used by async functions decorated with @with_db_connection(pool=True).
+    """
+    loop = asyncio.get_running_loop()
+    with _pool_lock:
+        pool = _async_pools.get(loop)
+        if pool is None:
+            settings = {key: value for key, value in _pool_settings.items() if key != 'thread_local'}
+            pool = _async_pools[loop] = AsyncSQLitePool(**settings)
+            _close_at_shutdown(pool, loop)
+        return pool
+
+
+def _close_at_shutdown(pool: AsyncSQLitePool, loop: asyncio.AbstractEventLoop) -> None:
+    # The event loop has no shutdown callbacks, but loop.shutdown_asyncgens() (called by
+    # asyncio.run()) closes every async generator that has started. One parked at its
+    # yield therefore runs its finally block, and closes the pool, at shutdown.
+    async def closer() -> AsyncIterator[None]:
+        try:
+            yield
+        finally:
+            await pool.close()
+
+    # The loop only keeps weak references to its async generators, so the pool holds this one
+    hook = pool._shutdown_hook = closer()
+    # Run it to its yield right away; a task might be cancelled before it ever started
+    try:
+        hook.asend(None).send(None)
+    except StopIteration:
+        pass
@@ -0,0 +1,1132 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import marshal
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Iterator, Protocol
+
+# Returned by QueryCache.get() on a miss, since None is a valid cached result
+MISSING = object()
+
+# Entries whose tables could not be parsed depend on every table
+ALL_TABLES = '*'
+
+# Comments and string literals, blanked out before looking for table names
+_LITERAL_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'", re.DOTALL)
+# Keywords followed by a table name, including UPDATE OR IGNORE and INSERT OR REPLACE INTO
+_SOURCE_PATTERN = re.compile(
+    r'\b(FROM|JOIN|INTO|UPDATE(?:\s+OR\s+\w+)?|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+',
+    re.IGNORECASE,
+)
+_IDENTIFIER = r'(?:"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+)'
+# A table name, optionally schema-qualified and quoted; group 1 is the (still quoted) name
+_NAME_PATTERN = re.compile(rf'(?:{_IDENTIFIER}\s*\.\s*)?({_IDENTIFIER})(?=[\s,;()]|$)')
+# An optional alias and the comma before the next table of a FROM list
+_NEXT_TABLE_PATTERN = re.compile(r'(?:\s+(?:AS\s+)?\w+)?\s*,\s*', re.IGNORECASE)
+_WRITE_PATTERN = re.compile(r'^\s*(?:INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+# The target of INSERT/REPLACE/UPDATE/DELETE; group 1 is the table name
+_WRITE_TARGET_PATTERN = re.compile(
+    r'^\s*(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+'
+    + _NAME_PATTERN.pattern,
+    re.IGNORECASE,
+)
+_CTE_WRITE_PATTERN = re.compile(r'^\s*WITH\b.*\b(?:INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE | re.DOTALL)
+# String literals and quoted identifiers, which normalization leaves untouched
+_QUOTED_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)""")
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Database file of each connection, so a cache lookup does not run PRAGMA database_list.
+# Only connections supporting weak references are remembered: pooled and aiosqlite ones,
+# not plain sqlite3.Connection objects.
+_database_files: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize a SQL statement so formatting differences share one cache entry.
+
+    Whitespace is collapsed, text outside quotes is lower-cased and a trailing
+    semicolon is dropped. Results are memoized, so repeated statements cost a
+    dict lookup.
+
+    Args:
+        sql: The SQL statement.
+
+    Returns:
+        The normalized statement.
+    """
+    parts = _QUOTED_PATTERN.split(sql.strip().rstrip(';').strip())
+    # split() puts the quoted parts at the odd indexes
+    return ''.join(
+        part if i % 2 else _WHITESPACE_PATTERN.sub(' ', part.lower())
+        for i, part in enumerate(parts)
+    )
+
+
+def params_digest(params: Any) -> str:
+    """
+    Hash the bound parameters of a query.
+
+    The digest is computed from repr(), so it is the same in every process,
+    unlike hash() of strings.
+
+    Args:
+        params: The parameters, e.g. a tuple or a dict of argument names to values.
+
+    Returns:
+        A short hex digest, empty when there are no parameters.
+    """
+    if not params:
+        return ''
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    return hashlib.blake2b(repr(params).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def database_file(conn: sqlite3.Connection | None) -> str | None:
+    """
+    Find the file of the main database of a connection, remembered per connection.
+
+    Args:
+        conn: The SQLite connection, or None.
+
+    Returns:
+        The database file path, '' when there is no connection, or None for an in-memory or temporary database.
+    """
+    if conn is None:
+        return ''
+    with contextlib.suppress(KeyError, TypeError):
+        return _database_files[conn]
+    path = None
+    for _, name, file in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            path = file or None
+            break
+    with contextlib.suppress(TypeError):
+        _database_files[conn] = path
+    return path
+
+
+def make_key(conn: sqlite3.Connection | None, sql: str, params: Any = None,
+             namespace: str = '') -> tuple[str, str, str, str] | None:
+    """
+    Build the cache key of a query.
+
+    Args:
+        conn: The connection the query runs on.
+        sql: The SQL statement.
+        params: The values bound to the statement.
+        namespace: Separates the results of functions running the same query,
+            e.g. one calling fetchone() and another fetchall().
+
+    Returns:
+        A (database file, namespace, normalized SQL, parameter digest) tuple, or None
+        when the result must not be cached because the database only lives in memory.
+    """
+    path = database_file(conn)
+    if path is None:
+        return None
+    return (path, namespace, normalize_sql(sql), params_digest(params))
+
+
+async def async_database_file(conn: Any) -> str | None:
+    """
+    Find the file of the main database of an aiosqlite connection, remembered per connection.
+
+    Args:
+        conn: The aiosqlite connection, or None.
+
+    Returns:
+        The database file path, '' when there is no connection, or None for an in-memory or temporary database.
+    """
+    if conn is None:
+        return ''
+    with contextlib.suppress(KeyError, TypeError):
+        return _database_files[conn]
+    path = None
+    async with conn.execute("PRAGMA database_list") as cursor:
+        for _, name, file in await cursor.fetchall():
+            if name == 'main':
+                path = file or None
+                break
+    with contextlib.suppress(TypeError):
+        _database_files[conn] = path
+    return path
+
+
+async def async_make_key(conn: Any, sql: str, params: Any = None,
+                         namespace: str = '') -> tuple[str, str, str, str] | None:
+    """
+    Build the cache key of a query run on an aiosqlite connection, like make_key().
+
+    Args:
+        conn: The aiosqlite connection the query runs on.
+        sql: The SQL statement.
+        params: The values bound to the statement.
+        namespace: Separates the results of functions running the same query.
+
+    Returns:
+        The same key make_key() builds for a sqlite3 connection to the same database, or None.
+    """
+    path = await async_database_file(conn)
+    if path is None:
+        return None
+    return (path, namespace, normalize_sql(sql), params_digest(params))
+
+
+def tables_in(sql: str) -> frozenset[str]:
+    """
+    Find the tables a SQL statement reads or writes.
+
+    Args:
+        sql: The SQL statement.
+
+    Returns:
+        The lower-cased table names after FROM (every table of a comma-separated
+        list), JOIN, INTO, UPDATE and TABLE, plus ALL_TABLES when one of these
+        keywords is not followed by something recognizable as a table name.
+    """
+    text = _LITERAL_PATTERN.sub(' ', sql)
+    tables = set()
+    for source in _SOURCE_PATTERN.finditer(text):
+        position = source.end()
+        while True:
+            if text.startswith('(', position):
+                # A subquery, whose own FROM is found by the outer loop
+                end = _closing_parenthesis(text, position)
+                if end is None:
+                    tables.add(ALL_TABLES)
+                    break
+            else:
+                name = _NAME_PATTERN.match(text, position)
+                if name is None:
+                    tables.add(ALL_TABLES)
+                    break
+                tables.add(_table_name(name.group(1)))
+                end = name.end()
+            following = _NEXT_TABLE_PATTERN.match(text, end)
+            if following is None or source.group(1).upper() != 'FROM':
+                break
+            position = following.end()
+    return frozenset(tables)
+
+
+def _closing_parenthesis(text: str, start: int) -> int | None:
+    """Return the index just past the parenthesis matching the one at start, or None."""
+    depth = 0
+    for index in range(start, len(text)):
+        if text[index] == '(':
+            depth += 1
+        elif text[index] == ')':
+            depth -= 1
+            if not depth:
+                return index + 1
+    return None
+
+
+def _table_name(identifier: str) -> str:
+    """Unquote and lower-case a table name matched by _NAME_PATTERN."""
+    if identifier[0] in '"`[':
+        identifier = identifier[1:-1].replace('""', '"')
+    return identifier.lower()
+
+
+def written_tables(sql: str) -> frozenset[str]:
+    """
+    Find the tables modified by a SQL statement.
+
+    Args:
+        sql: The SQL statement.
+
+    Returns:
+        The target table of an INSERT, UPDATE, DELETE or REPLACE statement, or an empty
+        set for reads. DDL, writes inside a WITH statement and any write whose target
+        cannot be parsed give ALL_TABLES, so a miss never leaves stale results behind.
+    """
+    text = _LITERAL_PATTERN.sub(' ', sql)
+    if _WRITE_PATTERN.match(text):
+        target = _WRITE_TARGET_PATTERN.match(text)
+        return frozenset([_table_name(target.group(1)) if target else ALL_TABLES])
+    if _CTE_WRITE_PATTERN.match(text):
+        return frozenset([ALL_TABLES])
+    return frozenset()
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimate the memory held by a query result.
+
+    Args:
+        value: A result such as a list of row tuples.
+
+    Returns:
+        The approximate size in bytes of the value and the containers, rows and values inside it.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return size
+
+
+# Counter bumped by every invalidation, which entries read from ALL_TABLES depend on
+_ANY_WRITE = ''
+
+
+def _generation_token(tables: Iterable[str], generation_of: Callable[[str], int]) -> tuple:
+    """
+    Snapshot the invalidation counters a result read from the given tables depends on.
+
+    Args:
+        tables: The lower-cased tables of the result.
+        generation_of: Returns the current counter of a table, ALL_TABLES or _ANY_WRITE.
+
+    Returns:
+        A token that changes whenever one of the tables is invalidated.
+    """
+    tables = set(tables) or {ALL_TABLES}
+    if ALL_TABLES in tables:
+        return (generation_of(_ANY_WRITE),)
+    return (generation_of(ALL_TABLES),) + tuple(generation_of(table) for table in sorted(tables))
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache for query results with a per-entry time to live.
+
+    The cache holds at most max_entries results and max_bytes of estimated
+    memory. Once a limit is reached, the least recently used entries are
+    evicted. Expired entries are dropped when they are next looked up.
+    Each entry records the tables it was read from, so a write to a table
+    can invalidate exactly the entries built from it. A result whose tables
+    were invalidated while it was being computed is not stored: take a
+    generation() before running the query and pass it to set().
+
+    Attributes:
+        max_entries (int): Maximum number of cached results.
+        max_bytes (int): Maximum estimated size of all cached results.
+        ttl (float | None): Default time to live in seconds, None to never expire.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float | None = 300.0):
+        """
+        Initialize an empty QueryCache.
+
+        Args:
+            max_entries: Maximum number of cached results. Defaults to 1024.
+            max_bytes: Maximum estimated size of all cached results in bytes. Defaults to 64 MiB.
+            ttl: Default time to live of an entry in seconds, None to never expire. Defaults to 300.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float | None, int, frozenset]] = OrderedDict()
+        self._keys_by_table: dict[str, set] = {}
+        self._generations: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is missing or expired. Defaults to MISSING.
+
+        Returns:
+            The cached result, or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, tables: Iterable[str]) -> tuple:
+        """
+        Snapshot the invalidations of some tables, before running the query that reads them.
+
+        Args:
+            tables: Tables the query reads.
+
+        Returns:
+            A token for set(), which skips the result if one of the tables was invalidated since.
+        """
+        tables = {table.lower() for table in tables}
+        with self._lock:
+            return _generation_token(tables, lambda table: self._generations.get(table, 0))
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = MISSING,
+            tables: Iterable[str] = (), generation: tuple | None = None) -> bool:
+        """
+        Store a result, evicting least recently used entries to stay within the limits.
+
+        Args:
+            key: The cache key.
+            value: The result to cache.
+            ttl: Time to live in seconds for this entry. Defaults to the cache's ttl.
+            tables: Tables the result was read from. An entry without tables is
+                invalidated by a write to any table.
+            generation: The generation() of the tables taken before the query ran, or None
+                to store the result unconditionally.
+
+        Returns:
+            True if the result was stored, False if it is larger than max_bytes on its own
+            or its tables were invalidated after the generation was taken.
+        """
+        ttl = self.ttl if ttl is MISSING else ttl
+        size = estimate_size(value)
+        tables = frozenset(table.lower() for table in tables) or frozenset([ALL_TABLES])
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return False
+            if generation is not None and generation != self.generation(tables):
+                return False  # computed from data a concurrent write has since changed
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            self._entries[key] = (value, expires_at, size, tables)
+            for table in tables:
+                self._keys_by_table.setdefault(table, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Remove one entry.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            True if the key was cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """
+        Remove every entry read from any of the given tables.
+
+        Args:
+            tables: Names of modified tables. ALL_TABLES clears the whole cache.
+
+        Returns:
+            The number of entries removed.
+        """
+        tables = {table.lower() for table in tables}
+        if not tables:
+            return 0
+        with self._lock:
+            if ALL_TABLES in tables:
+                count = len(self._entries)
+                self.clear()
+                return count
+            for table in tables | {_ANY_WRITE}:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            keys = set(self._keys_by_table.get(ALL_TABLES, ()))
+            for table in tables:
+                keys |= self._keys_by_table.get(table, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """Remove every entry, keeping the counters."""
+        with self._lock:
+            for table in (ALL_TABLES, _ANY_WRITE):
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._entries.clear()
+            self._keys_by_table.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Report the cache counters.
+
+        Returns:
+            A dict with hits, misses, evictions, expirations, entries and bytes.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size, tables = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._keys_by_table[table]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_table[table]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def dump_result(value: Any) -> bytes:
+    """
+    Serialize a query result for the on-disk cache.
+
+    Rows made of numbers, strings, bytes and None are written with marshal,
+    which is compact and much faster than pickle. Anything else falls back to pickle.
+
+    Args:
+        value: The result to serialize.
+
+    Returns:
+        The serialized bytes, prefixed with the format used.
+    """
+    try:
+        return b'm' + marshal.dumps(value)
+    except ValueError:
+        return b'p' + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_result(data: bytes) -> Any:
+    """
+    Deserialize a result written by dump_result().
+
+    Args:
+        data: The serialized bytes.
+
+    Returns:
+        The query result.
+    """
+    data = bytes(data)
+    if data[:1] == b'm':
+        return marshal.loads(data[1:])
+    return pickle.loads(data[1:])
+
+
+class CacheBackend(Protocol):
+    """The interface @cache_query and @transactional expect from a cache."""
+
+    ttl: float | None
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any: ...
+
+    def generation(self, tables: Iterable[str]) -> Any: ...
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = MISSING,
+            tables: Iterable[str] = (), generation: Any = None) -> bool: ...
+
+    def delete(self, key: Hashable) -> bool: ...
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int: ...
+
+    def clear(self) -> None: ...
+
+    def stats(self) -> dict: ...
+
+    def __contains__(self, key: Hashable) -> bool: ...
+
+
+@contextlib.contextmanager
+def _immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run a block in a BEGIN IMMEDIATE transaction on an autocommit connection."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class DiskCache:
+    """
+    Query result cache stored in a local SQLite file.
+
+    Every process opening the same file shares the cached results, and they
+    survive restarts. The file uses WAL mode, so readers never wait for a
+    writer. A hit only writes when its recency is more than touch_interval
+    seconds old, and skips that write if another connection holds the lock;
+    expired entries are left for set() to replace or evict. Reads, writes
+    and invalidations that fail (e.g. a locked or damaged file, or a result
+    that cannot be pickled) are reported in stats()['errors'] instead of
+    failing the query; a failed read counts as a miss.
+    Results are serialized with dump_result(). The limits, LRU eviction, table
+    invalidation and generations behave like QueryCache, with the generations
+    kept in the file so they hold across processes; expiry uses wall-clock time, as it
+    is compared across processes. Hit and miss counters are per process.
+    The file must only be writable by trusted users, since entries are unpickled.
+
+    Attributes:
+        path (str): The cache file.
+        max_entries (int): Maximum number of cached results.
+        max_bytes (int): Maximum total size of the serialized results.
+        ttl (float | None): Default time to live in seconds, None to never expire.
+    """
+
+    def __init__(self, path: str = 'query_cache.db', max_entries: int = 100_000,
+                 max_bytes: int = 256 * 1024 * 1024, ttl: float | None = 300.0, timeout: float = 5.0,
+                 touch_interval: float = 60.0):
+        """
+        Open (and if needed create) a cache file.
+
+        Args:
+            path: The SQLite file holding the cache. Defaults to 'query_cache.db'.
+            max_entries: Maximum number of cached results. Defaults to 100,000.
+            max_bytes: Maximum total size of the serialized results. Defaults to 256 MiB.
+            ttl: Default time to live of an entry in seconds, None to never expire. Defaults to 300.
+            timeout: Seconds to wait for another process holding the write lock. Defaults to 5.
+            touch_interval: Seconds between updates of an entry's last access time, which
+                orders LRU eviction. Defaults to 60.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+            CREATE TABLE IF NOT EXISTS entry_tables (
+                table_name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (table_name, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS entry_tables_key ON entry_tables (key);
+            CREATE TABLE IF NOT EXISTS generations (
+                table_name TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection to the cache file, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode; writes that must be atomic use explicit transactions
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, **counts: int) -> None:
+        with self._counter_lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return key if isinstance(key, str) else repr(key)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is missing or expired. Defaults to MISSING.
+
+        Returns:
+            The cached result, or default.
+        """
+        key = self._key(key)
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(misses=1)
+                return default
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at <= now:
+                # Left for set() to replace or evict, so a read never waits for the write lock
+                self._count(misses=1, expirations=1)
+                return default
+            result = load_result(value)
+        except Exception:
+            self._count(misses=1, errors=1)
+            return default
+        if now - accessed_at >= self.touch_interval:
+            self._touch(conn, key, now)
+        self._count(hits=1)
+        return result
+
+    def _touch(self, conn: sqlite3.Connection, key: str, now: float) -> None:
+        """Record an access for LRU eviction, unless another connection holds the write lock."""
+        try:
+            conn.execute("PRAGMA busy_timeout = 0")
+            try:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        except sqlite3.Error:
+            pass  # recency is only a hint for eviction
+
+    def generation(self, tables: Iterable[str]) -> Any:
+        """
+        Snapshot the invalidations of some tables, before running the query that reads them.
+
+        Args:
+            tables: Tables the query reads.
+
+        Returns:
+            A token for set(), which skips the result if one of the tables was invalidated
+            since, by any process. If the file cannot be read, a token that never matches.
+        """
+        try:
+            return self._generation(self._connection(), {table.lower() for table in tables})
+        except sqlite3.Error:
+            self._count(errors=1)
+            return MISSING
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection, tables: set[str]) -> tuple:
+        names = list((tables or {ALL_TABLES}) | {ALL_TABLES, _ANY_WRITE})
+        stored = dict(conn.execute(
+            f"SELECT table_name, generation FROM generations WHERE table_name IN ({', '.join('?' * len(names))})",
+            names))
+        return _generation_token(tables, lambda table: stored.get(table, 0))
+
+    @staticmethod
+    def _bump_generations(conn: sqlite3.Connection, tables: set[str]) -> None:
+        """Count an invalidation of the tables; the caller provides the transaction."""
+        conn.executemany(
+            "INSERT INTO generations (table_name, generation) VALUES (?, 1) "
+            "ON CONFLICT (table_name) DO UPDATE SET generation = generation + 1",
+            [(table,) for table in tables | {_ANY_WRITE}])
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = MISSING,
+            tables: Iterable[str] = (), generation: Any = None) -> bool:
+        """
+        Store a result, evicting least recently used entries to stay within the limits.
+
+        Args:
+            key: The cache key.
+            value: The result to cache.
+            ttl: Time to live in seconds for this entry. Defaults to the cache's ttl.
+            tables: Tables the result was read from. An entry without tables is
+                invalidated by a write to any table.
+            generation: The generation() of the tables taken before the query ran, or None
+                to store the result unconditionally.
+
+        Returns:
+            True if the result was stored, False if it is larger than max_bytes on its
+            own, its tables were invalidated after the generation was taken, or it could
+            not be serialized or written.
+        """
+        ttl = self.ttl if ttl is MISSING else ttl
+        key = self._key(key)
+        try:
+            data = dump_result(value)
+            if len(data) > self.max_bytes:
+                self.delete(key)
+                return False
+            evicted = self._store(key, data, ttl, tables, generation)
+        except Exception:
+            # e.g. an unpicklable sqlite3.Row result, or a locked file
+            self._count(errors=1)
+            return False
+        if evicted is None:
+            return False
+        self._count(evictions=evicted)
+        return True
+
+    def _store(self, key: str, data: bytes, ttl: float | None, tables: Iterable[str],
+               generation: Any) -> int | None:
+        """
+        Write an entry and evict to stay within the limits.
+
+        Returns the number of entries evicted, or None if the tables changed since generation.
+        """
+        now = time.time()
+        tables = {table.lower() for table in tables} or {ALL_TABLES}
+        conn = self._connection()
+        with _immediate_transaction(conn):
+            if generation is not None and self._generation(conn, tables) != generation:
+                return None
+            conn.execute("DELETE FROM entry_tables WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl if ttl is not None else None, now),
+            )
+            conn.executemany("INSERT INTO entry_tables (table_name, key) VALUES (?, ?)",
+                             [(table, key) for table in tables])
+            count, total = conn.execute("SELECT COUNT(*), TOTAL(size) FROM entries").fetchone()
+            evicted = []
+            if count > self.max_entries or total > self.max_bytes:
+                # Expired entries go first, then the least recently used
+                for old_key, size in conn.execute(
+                        "SELECT key, size FROM entries WHERE key != ? "
+                        "ORDER BY CASE WHEN expires_at <= ? THEN 0 ELSE 1 END, accessed_at", (key, now)):
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    evicted.append(old_key)
+                    count -= 1
+                    total -= size
+                self._delete_keys(conn, evicted)
+        return len(evicted)
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Remove one entry.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            True if the key was cached.
+        """
+        conn = self._connection()
+        with _immediate_transaction(conn):
+            return self._delete_keys(conn, [self._key(key)]) > 0
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """
+        Remove every entry read from any of the given tables, in every process.
+
+        This runs after the write has committed, so a failure is counted in
+        stats()['errors'] rather than raised; the entries of those tables then
+        stay until their ttl expires.
+
+        Args:
+            tables: Names of modified tables. ALL_TABLES clears the whole cache.
+
+        Returns:
+            The number of entries removed.
+        """
+        tables = {table.lower() for table in tables}
+        if not tables:
+            return 0
+        try:
+            return self._invalidate(tables)
+        except sqlite3.Error:
+            self._count(errors=1)
+            return 0
+
+    def _invalidate(self, tables: Iterable[str]) -> int:
+        conn = self._connection()
+        with _immediate_transaction(conn):
+            self._bump_generations(conn, tables)
+            if ALL_TABLES in tables:
+                count = conn.execute("DELETE FROM entries").rowcount
+                conn.execute("DELETE FROM entry_tables")
+                return count
+            names = list(tables) + [ALL_TABLES]
+            keys = [key for (key,) in conn.execute(
+                f"SELECT DISTINCT key FROM entry_tables WHERE table_name IN ({', '.join('?' * len(names))})",
+                names)]
+            return self._delete_keys(conn, keys)
+
+    def clear(self) -> None:
+        """Remove every entry, keeping the counters."""
+        conn = self._connection()
+        with _immediate_transaction(conn):
+            self._bump_generations(conn, {ALL_TABLES})
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM entry_tables")
+
+    def stats(self) -> dict:
+        """
+        Report the cache counters.
+
+        Returns:
+            A dict with this process's hits, misses, evictions, expirations and backend errors,
+            and the entries and bytes on disk.
+        """
+        entries, size = self._connection().execute("SELECT COUNT(*), TOTAL(size) FROM entries").fetchone()
+        with self._counter_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'errors': self.errors,
+                'entries': entries,
+                'bytes': int(size),
+            }
+
+    def close(self) -> None:
+        """Close this thread's connection to the cache file."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _delete_keys(conn: sqlite3.Connection, keys: list[str]) -> int:
+        """Delete entries and their table links; the caller provides the transaction."""
+        removed = 0
+        for key in keys:
+            removed += conn.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount
+            conn.execute("DELETE FROM entry_tables WHERE key = ?", (key,))
+        return removed
+
+    def __contains__(self, key: Hashable) -> bool:
+        try:
+            row = self._connection().execute(
+                "SELECT expires_at FROM entries WHERE key = ?", (self._key(key),)).fetchone()
+        except sqlite3.Error:
+            self._count(errors=1)
+            return False
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class _Flight:
+    """One in-flight computation and the outcome its waiters receive."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single execution.
+
+    While one thread runs the function for a key, other threads asking for
+    that key wait for it and receive its result (or exception) instead of
+    running the function themselves.
+    """
+
+    def __init__(self):
+        """Initialize with no calls in flight."""
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        Run func for key, or wait for the run already in flight.
+
+        Args:
+            key: Identifies the computation.
+            func: Computes the result when this call leads the flight.
+
+        Returns:
+            The result of the leading call.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def do_in_background(self, key: Hashable, func: Callable[[], Any]) -> bool:
+        """
+        Start func for key on a daemon thread unless a run is already in flight.
+
+        Args:
+            key: Identifies the computation.
+            func: The function to run. Its exceptions are left to func to report.
+
+        Returns:
+            True if a background run was started.
+        """
+        with self._lock:
+            if key in self._flights:
+                return False
+            flight = self._flights[key] = _Flight()
+
+        def run() -> None:
+            try:
+                flight.result = func()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        threading.Thread(target=run, name='cache-refresh', daemon=True).start()
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._flights
+
+
+class AsyncSingleFlight:
+    """
+    Asyncio counterpart of SingleFlight, coalescing concurrent awaits for the same key.
+
+    The leading call runs as a task that the other callers await; it is shielded,
+    so cancelling one waiter does not cancel the query for the others. Flights are
+    kept per event loop, so the same instance can serve functions called from
+    several loops.
+    """
+
+    def __init__(self):
+        """Initialize with no calls in flight."""
+        self._flights: dict[tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+
+    def _start(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> tuple[asyncio.Task, bool]:
+        flight_key = (asyncio.get_running_loop(), key)
+        task = self._flights.get(flight_key)
+        if task is not None:
+            return task, False
+        task = self._flights[flight_key] = asyncio.ensure_future(func())
+
+        def finished(_: asyncio.Task) -> None:
+            if self._flights.get(flight_key) is task:
+                del self._flights[flight_key]
+
+        task.add_done_callback(finished)
+        return task, True
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await func() for key, or the run already in flight.
+
+        Args:
+            key: Identifies the computation.
+            func: Returns the awaitable computing the result when this call leads the flight.
+
+        Returns:
+            The result of the leading call.
+        """
+        task, _ = self._start(key, func)
+        return await asyncio.shield(task)
+
+    def do_in_background(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        Start func() as a task for key unless a run is already in flight.
+
+        Args:
+            key: Identifies the computation.
+            func: Returns the awaitable to run. Its exceptions are left to func to report.
+
+        Returns:
+            True if a background run was started.
+        """
+        return self._start(key, func)[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        try:
+            return (asyncio.get_running_loop(), key) in self._flights
+        except RuntimeError:
+            return False
+
+
+# Cache shared by the decorators of every module, so writes made through
+# @transactional invalidate the results cached by @cache_query
+shared_cache: CacheBackend = QueryCache()
+
+
+def get_shared_cache() -> CacheBackend:
+    """
+    Return the cache used by the decorators when none is given.
+
+    Returns:
+        The shared cache backend.
+    """
+    return shared_cache
+
+
+def set_shared_cache(cache: CacheBackend) -> None:
+    """
+    Replace the cache used by the decorators when none is given.
+
+    For example, set_shared_cache(DiskCache('/var/tmp/users_cache.db')) in each
+    worker process makes all the workers of a host share warm results.
+
+    Args:
+        cache: A QueryCache, DiskCache or other CacheBackend.
+    """
+    global shared_cache
+    shared_cache = cache
+
+
+async def cache_call(store: CacheBackend, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Call a cache backend from a coroutine without blocking the event loop.
+
+    QueryCache only takes an in-memory lock, so it is called directly. Other
+    backends, such as DiskCache with its SQLite file and busy timeout, are
+    called on a worker thread.
+
+    Args:
+        store: The cache backend the call uses.
+        func: The function to call, e.g. store.get.
+        *args: Positional arguments for func.
+        **kwargs: Keyword arguments for func.
+
+    Returns:
+        The result of func.
+    """
+    if isinstance(store, QueryCache):
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
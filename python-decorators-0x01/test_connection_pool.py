@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+""" Tests for the shared sync and async SQLite connection pools """
+import importlib.util
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from connection_pool import SQLitePool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Every decorated coroutine borrows from the shared async pool, then the pool
+# is reconfigured while the loop runs, so both the discarded pool and the new
+# one must be closed for the interpreter to exit
+SCRIPT = """
+import asyncio
+import connection_pool
+with_db_connection = __import__({module!r}).with_db_connection
+
+@with_db_connection(pool=True)
+async def count_users(conn):
+    async with conn.execute("SELECT count(*) FROM users") as cursor:
+        return (await cursor.fetchone())[0]
+
+async def main():
+    first = await count_users()
+    connection_pool.configure(size=2)
+    return first, await count_users()
+
+print(asyncio.run(main()))
+"""
+
+
+def make_users_db(directory):
+    """ create the users table the demos of the decorator modules query """
+    conn = sqlite3.connect(os.path.join(directory, 'users.db'))
+    for table in ('users', 'user'):
+        conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "name TEXT NOT NULL, age INTEGER NOT NULL, email TEXT NOT NULL)")
+        conn.execute(f"INSERT INTO {table} (name, age, email) VALUES ('Alice', 30, 'alice@mail.com')")
+    conn.commit()
+    conn.close()
+
+
+def is_closed(conn):
+    """ whether a sqlite3 connection has been closed """
+    try:
+        conn.execute("SELECT 1")
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
+
+class TestSQLitePoolClose(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ create a database in a temporary directory """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        make_users_db(self.directory.name)
+        self.path = os.path.join(self.directory.name, 'users.db')
+
+    def test_closes_other_threads_connections(self):
+        """ close() closes the thread-local connections of threads that are still alive """
+        pool = SQLitePool(self.path, thread_local=True)
+        used, done = [], threading.Event()
+        busy = pool.acquire()
+
+        def work():
+            with pool.connection() as conn:
+                used.append(conn)
+            done.wait(5)
+            # the closed connection is replaced on the next use
+            with pool.connection() as conn:
+                used.append(conn)
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while len(used) < 3:
+            threading.Event().wait(0.01)
+        pool.close()
+        self.assertTrue(all(is_closed(conn) for conn in used))
+        self.assertFalse(is_closed(busy))
+        pool.release(busy)
+        self.assertTrue(is_closed(busy))
+
+        done.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertFalse(any(is_closed(conn) for conn in used[3:]))
+        pool.close()
+
+    def test_closes_borrowed_connection_on_release(self):
+        """ a shared connection borrowed during close() is closed when released """
+        pool = SQLitePool(self.path, size=2)
+        idle, borrowed = pool.acquire(), pool.acquire()
+        pool.release(idle)
+        pool.close()
+        self.assertTrue(is_closed(idle))
+        self.assertFalse(is_closed(borrowed))
+        pool.release(borrowed)
+        self.assertTrue(is_closed(borrowed))
+        self.assertEqual(pool.metrics()['idle'], 0)
+
+
+@unittest.skipIf(importlib.util.find_spec('aiosqlite') is None, "aiosqlite is not installed")
+class TestAsyncPoolShutdown(unittest.TestCase):
+    """ TESTCASE """
+
+    def test_process_exits(self):
+        """ asyncio.run() with pool=True returns and the interpreter exits """
+        modules = ('1-with_db_connection', '2-transactional', '3-retry_on_failure', '4-cache_query')
+        for module in modules:
+            with self.subTest(module=module), tempfile.TemporaryDirectory() as directory:
+                make_users_db(directory)
+                env = dict(os.environ, PYTHONPATH=HERE)
+                try:
+                    done = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)],
+                                          cwd=directory, env=env, capture_output=True,
+                                          text=True, timeout=30)
+                except subprocess.TimeoutExpired:
+                    self.fail(f"{module}: the process did not exit after asyncio.run() returned")
+                self.assertEqual(done.returncode, 0, done.stderr)
+                self.assertEqual(done.stdout.strip().splitlines()[-1], '(1, 1)')
+
+
+@unittest.skipIf(importlib.util.find_spec('aiosqlite') is None, "aiosqlite is not installed")
+class TestAsyncSQLitePool(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ create a database in a temporary directory """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        make_users_db(self.directory.name)
+        self.path = os.path.join(self.directory.name, 'users.db')
+
+    def test_async_with_closes_connections(self):
+        """ leaving "async with pool" closes the idle and the in-use connections """
+        import asyncio
+        from connection_pool import AsyncSQLitePool
+
+        async def run():
+            async with AsyncSQLitePool(self.path, size=2) as pool:
+                async with pool.connection():
+                    async with pool.connection() as conn:
+                        held = conn
+                    self.assertEqual(pool.metrics()['idle'], 1)
+                    await pool.close()
+                # released after close(), so closed instead of kept
+                self.assertEqual(pool.metrics()['idle'], 0)
+            return held
+
+        held = asyncio.run(run())
+        self.assertIsNone(held._connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
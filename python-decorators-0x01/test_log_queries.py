@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Tests for the structured records of 0-log_queries """
+import importlib
+import inspect
+import logging
+import os
+import tempfile
+import unittest
+from test_connection_pool import make_users_db
+
+
+class RecordingHandler(logging.Handler):
+    """ keep the query events logged """
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def emit(self, record):
+        self.events.append(record.query_event)
+
+
+class TestStructuredCaller(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ run in a temporary directory holding users.db, logging to a recording handler """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        make_users_db(directory.name)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.log_queries = importlib.import_module('0-log_queries').log_queries
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('test_log_queries')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def check_caller(self, decorate):
+        """ the caller of a decorated call is the line making it, whatever is stacked on top """
+        @decorate
+        @self.log_queries(structured=True, logger=self.logger)
+        def fetch_users(conn, query):
+            return conn.execute(query).fetchall()
+
+        line = inspect.currentframe().f_lineno + 1
+        fetch_users(query="SELECT * FROM users")
+        caller = self.handler.events[-1]['caller']
+        self.assertEqual(caller, f"{__file__}:{line} in check_caller")
+
+    def test_caller_under_decorators(self):
+        """ with_db_connection, cache_query and transactional wrappers are skipped """
+        with_db_connection = importlib.import_module('1-with_db_connection').with_db_connection
+        cache_query = importlib.import_module('4-cache_query').cache_query
+        transactional = importlib.import_module('2-transactional').transactional
+        stacks = {
+            'with_db_connection': with_db_connection,
+            'with_db_connection(pool=True)': with_db_connection(pool=True),
+            'cache_query': lambda func: with_db_connection(cache_query(func)),
+            'transactional': lambda func: with_db_connection(transactional(func)),
+        }
+        for name, decorate in stacks.items():
+            with self.subTest(stack=name):
+                self.check_caller(decorate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+""" Tests for the table parsing and invalidation of query_cache """
+import asyncio
+import importlib
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from connection_pool import PooledConnection
+from query_cache import ALL_TABLES, DiskCache, QueryCache, make_key, tables_in, written_tables
+
+
+class TestTablesIn(unittest.TestCase):
+    """ TESTCASE """
+
+    def test_tables_in(self):
+        """ every table a query reads is found """
+        cases = [
+            ("SELECT * FROM users", {'users'}),
+            ("SELECT * FROM users, orders WHERE users.id = orders.user_id", {'users', 'orders'}),
+            ("SELECT * FROM users AS u, main.orders o, [line items]", {'users', 'orders', 'line items'}),
+            ("SELECT * FROM (SELECT * FROM users) AS u, orders", {'users', 'orders'}),
+            ("SELECT * FROM users JOIN orders ON 1 WHERE id IN (SELECT id FROM items)",
+             {'users', 'orders', 'items'}),
+            ("SELECT * FROM users WHERE name = 'FROM nowhere' -- FROM comments", {'users'}),
+            ("SELECT * FROM users ORDER BY age, name", {'users'}),
+        ]
+        for sql, expected in cases:
+            with self.subTest(sql=sql):
+                self.assertEqual(tables_in(sql), frozenset(expected))
+
+    def test_unparsed_source_depends_on_every_table(self):
+        """ a FROM that is not followed by a table name falls back to ALL_TABLES """
+        self.assertIn(ALL_TABLES, tables_in("SELECT * FROM (SELECT * FROM users"))
+
+
+class TestWrittenTables(unittest.TestCase):
+    """ TESTCASE """
+
+    def test_written_tables(self):
+        """ the target of a write is found, reads write nothing """
+        cases = [
+            ("UPDATE users SET age = 1", {'users'}),
+            ("UPDATE OR IGNORE users SET age = 1", {'users'}),
+            ("INSERT OR REPLACE INTO users (name) VALUES ('x')", {'users'}),
+            ("INSERT INTO orders SELECT * FROM users", {'orders'}),
+            ("REPLACE INTO users VALUES (1)", {'users'}),
+            ("DELETE FROM main.\"Users\" WHERE name = 'UPDATE x'", {'users'}),
+            ("-- leading comment\nDELETE FROM users", {'users'}),
+            ("WITH old AS (SELECT id FROM users) UPDATE users SET age = 1", {ALL_TABLES}),
+            ("CREATE TABLE IF NOT EXISTS users (id INTEGER)", {ALL_TABLES}),
+            ("SELECT * FROM users", set()),
+            ("WITH old AS (SELECT id FROM users) SELECT * FROM old", set()),
+        ]
+        for sql, expected in cases:
+            with self.subTest(sql=sql):
+                self.assertEqual(written_tables(sql), frozenset(expected))
+
+
+class TestInvalidation(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ cache one result that reads two tables """
+        self.cache = QueryCache()
+        sql = "SELECT * FROM users, orders"
+        self.cache.set('joined', ['row'], tables=tables_in(sql))
+
+    def test_write_to_second_table_invalidates(self):
+        """ a write to the second table of a FROM list drops the result """
+        self.cache.invalidate_tables(written_tables("UPDATE OR IGNORE orders SET total = 0"))
+        self.assertNotIn('joined', self.cache)
+
+    def test_cte_write_invalidates(self):
+        """ a write behind a WITH clause drops every result """
+        self.cache.invalidate_tables(written_tables("WITH x AS (SELECT 1) DELETE FROM orders"))
+        self.assertNotIn('joined', self.cache)
+
+    def test_unrelated_write_keeps_result(self):
+        """ a write to another table keeps the result """
+        self.cache.invalidate_tables(written_tables("DELETE FROM items"))
+        self.assertIn('joined', self.cache)
+
+
+class TestMakeKey(unittest.TestCase):
+    """ TESTCASE """
+
+    def test_database_file_is_remembered(self):
+        """ only the first key built on a pooled connection queries its database file """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.db')
+            conn = sqlite3.connect(path, factory=PooledConnection)
+            statements = []
+            conn.set_trace_callback(statements.append)
+            keys = [make_key(conn, "SELECT * FROM users") for _ in range(3)]
+            conn.close()
+        self.assertEqual(keys[0][0], path)
+        self.assertEqual(len(set(keys)), 1)
+        self.assertEqual(len(statements), 1)
+
+    def test_memory_database_is_not_cached(self):
+        """ an in-memory database has no key, also once remembered """
+        conn = sqlite3.connect(':memory:', factory=PooledConnection)
+        self.assertIsNone(make_key(conn, "SELECT 1"))
+        self.assertIsNone(make_key(conn, "SELECT 1"))
+        conn.close()
+
+
+class TestDiskCache(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ cache one result in a file of a temporary directory """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'cache.db')
+        self.cache = DiskCache(self.path, timeout=2.0)
+        self.cache.set('users', ['row'], tables={'users'})
+        self.other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(self.other.close)
+
+    def accessed_at(self):
+        """ the last access time stored for the entry """
+        return self.other.execute("SELECT accessed_at FROM entries").fetchone()[0]
+
+    def test_hit_does_not_wait_for_writer(self):
+        """ a hit returns at once while another connection holds the write lock """
+        self.other.execute("UPDATE entries SET accessed_at = 0")
+        self.other.execute("BEGIN IMMEDIATE")
+        start = time.monotonic()
+        self.assertEqual(self.cache.get('users'), ['row'])
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.other.execute("COMMIT")
+        self.assertEqual(self.accessed_at(), 0)
+
+    def test_recency_updated_after_interval(self):
+        """ hits only write the access time once it is touch_interval old """
+        stored = self.accessed_at()
+        self.cache.get('users')
+        self.assertEqual(self.accessed_at(), stored)
+        self.other.execute("UPDATE entries SET accessed_at = accessed_at - 120")
+        self.cache.get('users')
+        self.assertGreaterEqual(self.accessed_at(), stored)
+
+    def test_backend_error_is_a_miss(self):
+        """ a failing read or write is reported as a miss, not raised """
+        self.other.execute("DROP TABLE entries")
+        self.assertEqual(self.cache.get('users', 'default'), 'default')
+        self.assertNotIn('users', self.cache)
+        self.assertFalse(self.cache.set('users', ['row']))
+        self.assertEqual(self.cache.invalidate_tables({'users'}), 0)
+        self.assertEqual(self.cache.errors, 4)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_unpicklable_result_is_skipped(self):
+        """ a result that cannot be serialized is not stored, and does not raise """
+        self.other.row_factory = sqlite3.Row
+        rows = self.other.execute("SELECT key FROM entries").fetchall()
+        self.assertFalse(self.cache.set('rows', rows))
+        self.assertEqual(self.cache.errors, 1)
+        self.assertNotIn('rows', self.cache)
+
+
+class TestConcurrentInvalidation(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ run in a temporary directory holding users.db """
+        from test_connection_pool import make_users_db
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        make_users_db(directory.name)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.module = importlib.import_module('4-cache_query')
+
+    def check_write_during_miss(self, cache):
+        """ a result read before a concurrent write is invalidated is not stored """
+        read, written = threading.Event(), threading.Event()
+
+        @self.module.with_db_connection
+        @self.module.cache_query(cache=cache)
+        def fetch_names(conn, query):
+            rows = conn.execute(query).fetchall()
+            if not read.is_set():
+                read.set()
+                written.wait(5)  # the write commits while this result is still unsaved
+            return rows
+
+        query = "SELECT name FROM users"
+        results = []
+        reader = threading.Thread(target=lambda: results.append(fetch_names(query=query)))
+        reader.start()
+        self.assertTrue(read.wait(5))
+        conn = sqlite3.connect('users.db')
+        conn.execute("UPDATE users SET name = 'Carol'")
+        conn.commit()
+        conn.close()
+        cache.invalidate_tables(written_tables("UPDATE users SET name = 'Carol'"))
+        written.set()
+        reader.join(5)
+        self.assertEqual(results, [[('Alice',)]])
+        self.assertEqual(fetch_names(query=query), [('Carol',)])
+
+    def test_query_cache(self):
+        """ QueryCache drops the stale result """
+        self.check_write_during_miss(QueryCache())
+
+    def test_disk_cache(self):
+        """ DiskCache drops the stale result """
+        self.check_write_during_miss(DiskCache(os.path.join(os.getcwd(), 'cache.db')))
+
+    def test_generation(self):
+        """ only an invalidation of the result's tables or of every table changes its generation """
+        cache = QueryCache()
+        generation = cache.generation({'users'})
+        any_table = cache.generation({ALL_TABLES})
+        cache.invalidate_tables({'orders'})
+        self.assertEqual(cache.generation({'users'}), generation)
+        self.assertNotEqual(cache.generation({ALL_TABLES}), any_table)
+        cache.invalidate_tables({ALL_TABLES})
+        self.assertFalse(cache.set('users', ['row'], tables={'users'}, generation=generation))
+        self.assertNotIn('users', cache)
+
+
+@unittest.skipIf(importlib.util.find_spec('aiosqlite') is None, "aiosqlite is not installed")
+class TestAsyncDiskCache(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ run in a temporary directory holding users.db """
+        from test_connection_pool import make_users_db
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        make_users_db(directory.name)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.module = importlib.import_module('4-cache_query')
+
+    def test_locked_cache_does_not_block_loop(self):
+        """ a cache file waiting on another writer leaves the event loop running """
+        cache = DiskCache('cache.db', timeout=0.5)
+
+        @self.module.with_db_connection
+        @self.module.cache_query(cache=cache)
+        async def fetch_names(conn, query):
+            async with conn.execute(query) as cursor:
+                return await cursor.fetchall()
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.create_task(tick())
+            rows = await fetch_names(query="SELECT name FROM users")
+            ticker.cancel()
+            return rows, ticks
+
+        locker = sqlite3.connect('cache.db', isolation_level=None)
+        locker.execute("BEGIN IMMEDIATE")
+        try:
+            rows, ticks = asyncio.run(run())
+        finally:
+            locker.execute("ROLLBACK")
+            locker.close()
+        self.assertEqual(rows, [('Alice',)])
+        self.assertGreater(ticks, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Tests for the batched transactions of 2-transactional """
+import importlib
+import os
+import sqlite3
+import tempfile
+import unittest
+from query_cache import QueryCache
+from test_connection_pool import make_users_db
+
+
+class TestBatchedTransaction(unittest.TestCase):
+    """ TESTCASE """
+
+    def setUp(self):
+        """ run in a temporary directory holding users.db """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        make_users_db(directory.name)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.module = importlib.import_module('2-transactional')
+
+    def run_failing_batch(self, **options):
+        """ add a user, then fail a second insert and let the error leave the scope """
+        module = self.module
+        cache = QueryCache()
+
+        @module.with_db_connection
+        @module.transactional(cache=cache)
+        def add_user(conn, name):
+            conn.execute("INSERT INTO users (name, age, email) VALUES (?, 20, ?)", (name, name))
+
+        @module.with_db_connection
+        @module.transactional(cache=cache)
+        def add_user_then_fail(conn, name):
+            add_user.__wrapped__.__wrapped__(conn, name)
+            raise ValueError("invalid user")
+
+        with self.assertRaises(ValueError):
+            with module.batched_transaction(**options) as batch:
+                add_user(name='Bob')
+                add_user_then_fail(name='Carol')
+        self.assertEqual(batch.failed, 1)
+        conn = sqlite3.connect('users.db')
+        try:
+            return {name for (name,) in conn.execute("SELECT name FROM users")}
+        finally:
+            conn.close()
+
+    def test_error_keeps_succeeded_operations(self):
+        """ by default the operations that succeeded are committed """
+        self.assertEqual(self.run_failing_batch(), {'Alice', 'Bob'})
+
+    def test_rollback_on_error(self):
+        """ rollback_on_error=True discards every pending operation """
+        self.assertEqual(self.run_failing_batch(rollback_on_error=True), {'Alice'})
+
+
+if __name__ == '__main__':
+    unittest.main()
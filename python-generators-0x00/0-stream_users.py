@@ -1,44 +1,58 @@
 
-import mysql.connector as connector
-from mysql.connector import errorcode, Error
+import db_pool
+import seed
+from user_query import UserQuery
 
 def connect_to_prodev():
-  """ Connect to the ALX_prodev database and return the connection object."""
-  try:
-    cnx = connector.connect(
-      user='prodev', 
-      password='password123',
-      host='localhost',
-      database='ALX_prodev'
-    )
-    if cnx.is_connected():
-      return cnx
-  except Error as err:
-    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-      print("Wrong username or password")
-    elif err.errno == errorcode.ER_BAD_DB_ERROR:
-      print("Database does not exist")
-    else:
-      print(err)
-  return None
-
-def stream_users():
-  """ Generator function to fetch rows one by one from the user_data table."""
+  """ Borrow a connection to the ALX_prodev database from the shared pool."""
+  return db_pool.connect()
+
+def stream_users(chunk_size=None, dictionary=True, query=None):
+  """ Generator function to fetch rows one by one from the user_data table.
+
+  With the defaults each row is read with ``fetchone()`` from a dictionary
+  cursor. Passing ``chunk_size`` switches to streaming mode: an unbuffered
+  cursor reads rows off the server connection ``chunk_size`` at a time with
+  ``fetchmany()``, so memory stays bounded by one chunk whatever the table
+  size. Set ``dictionary=False`` to get plain tuples in
+  ``(user_id, name, email, age)`` order and skip building a dict per row.
+  BINARY(16) user_ids are converted, so callers always see string UUIDs.
+
+  ``query`` is an optional UserQuery choosing the columns, the age/email
+  predicates and the ordering; they are applied by MySQL, so only the
+  requested columns of the matching rows are sent.
+  """
+  query = query or UserQuery()
+  sql, params = query.to_sql()
+  user_id_index = query.user_id_index()
   connection = connect_to_prodev()
   if not connection:
     return
 
-  cursor = connection.cursor(dictionary=True)
-  cursor.execute("SELECT * FROM user_data")
-
-  while True:
-    row = cursor.fetchone()
-    if row is None:
-      break
-    yield row
-
-  cursor.close()
-  connection.close()
+  try:
+    if chunk_size is None:
+      cursor = connection.cursor(dictionary=dictionary)
+      cursor.execute(sql, params)
+
+      while True:
+        row = cursor.fetchone()
+        if row is None:
+          break
+        yield seed.convert_user_row(row, user_id_index)
+    else:
+      cursor = connection.cursor(buffered=False, dictionary=dictionary)
+      cursor.execute(sql, params)
+
+      while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+          break
+        yield from seed.convert_user_rows(rows, user_id_index)
+
+    cursor.close()
+  finally:
+    # Also runs when the consumer stops early, so the pooled connection is returned
+    connection.close()
 
 if __name__ == "__main__":
   from itertools import islice
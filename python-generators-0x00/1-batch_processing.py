@@ -1,52 +1,285 @@
-import mysql.connector as connector
-from mysql.connector import errorcode, Error
+import os
+import queue
+import uuid
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+import db_pool
+import seed
+from prefetch import prefetch
+from user_query import DEFAULT_COLUMNS, UserQuery
 
-config = {
-  'user': 'prodev',
-  'password': 'password123',
-  'host': 'localhost',
-  'database': 'ALX_prodev'
-}
+try:
+  import numpy as np
+except ImportError:  # NumPy is optional, only needed for columnar='numpy'
+  np = None
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+except ImportError:  # PyArrow is optional, only needed for columnar='arrow'
+  pa = pc = None
 
 def connect_db():
-  """Connect to database and return the connection object."""
+  """Borrow a connection to the database from the shared pool."""
+  return db_pool.connect()
+
+def stream_users_in_batches(batch_size, key_range=None, min_age=None, connection=None, columnar=None,
+                            query=None, limit=None):
+  """Generator function to fetch rows in batches from the user_data table.
+
+  ``key_range`` is a ``(low, high)`` pair limiting the scan to
+  ``low <= user_id < high`` (either end may be None) and ``min_age`` adds an
+  ``age >= min_age`` predicate, both evaluated by MySQL. Range bounds are
+  given in the stored form (see user_id_ranges()); yielded rows always
+  carry string user_ids. A caller supplied ``connection`` is reused and
+  left open.
+
+  ``query`` is an optional UserQuery selecting the columns, age/email
+  predicates and ordering, all applied by MySQL (``min_age`` is a
+  shorthand for its age >= predicate). ``limit`` caps the number of rows
+  read.
+
+  With ``columnar='numpy'`` each batch is a dict of NumPy arrays keyed by
+  column name, and with ``columnar='arrow'`` it is a pyarrow RecordBatch.
+  Strings are then held in contiguous buffers instead of one dict and
+  several str objects per row; see to_columns().
+  """
+  if columnar not in (None, 'numpy', 'arrow'):
+    raise ValueError(f"Unknown columnar format: {columnar!r}")
+  query = query or UserQuery()
+
+  conditions = []
+  params = []
+  if key_range is not None:
+    low, high = key_range
+    if low is not None:
+      conditions.append("user_id >= %s")
+      params.append(low)
+    if high is not None:
+      conditions.append("user_id < %s")
+      params.append(high)
+  if min_age is not None:
+    conditions.append("age >= %s")
+    params.append(min_age)
+  sql, params = query.to_sql(conditions, params, limit=limit)
+  user_id_index = query.user_id_index()
+
+  owns_connection = connection is None
+  if owns_connection:
+    connection = connect_db()
+    if not connection:
+      return None
+
+  try:
+    cursor = connection.cursor(dictionary=columnar is None)
+    cursor.execute(sql, params)
+
+    while True:
+      rows = cursor.fetchmany(batch_size)
+      if not rows:
+        break
+      rows = seed.convert_user_rows(rows, user_id_index)
+      yield rows if columnar is None else to_columns(rows, columnar, query.columns)
+
+    cursor.close()
+  finally:
+    if owns_connection:
+      connection.close()
+
+def to_columns(rows, columnar='numpy', columns=DEFAULT_COLUMNS):
+  """Convert row tuples with the given column names into a columnar batch."""
+  values = zip(*rows)
+  if columnar == 'numpy':
+    if np is None:
+      raise ImportError("NumPy is required for columnar='numpy'")
+    # Fixed width unicode arrays store the text inline, without a str object per value
+    dtypes = {'user_id': 'U36', 'age': np.int32, 'updated_at': 'datetime64[us]'}
+    return {name: np.array(column, dtype=dtypes.get(name, str)) for name, column in zip(columns, values)}
+  if pa is None:
+    raise ImportError("PyArrow is required for columnar='arrow'")
+  types = {'age': pa.int32(), 'updated_at': pa.timestamp('us')}
+  return pa.record_batch(
+    [pa.array(column, type=types.get(name, pa.string())) for name, column in zip(columns, values)],
+    names=list(columns),
+  )
+
+def filter_columns(batch, mask):
+  """Return the rows of a columnar batch where the boolean mask is true."""
+  if isinstance(batch, dict):
+    return {name: column[mask] for name, column in batch.items()}
+  return batch.filter(mask)
+
+def age_at_least(batch, min_age):
+  """Vectorized ``age >= min_age`` mask for a columnar batch."""
+  if isinstance(batch, dict):
+    return batch['age'] >= min_age
+  return pc.greater_equal(batch.column('age'), min_age)
+
+def column_rows(batch):
+  """Iterate a columnar batch as user dicts."""
+  if isinstance(batch, dict):
+    names = list(batch)
+    columns = [batch[name].tolist() for name in names]
+  else:
+    names = batch.schema.names
+    columns = [batch.column(name).to_pylist() for name in names]
+  for values in zip(*columns):
+    yield dict(zip(names, values))
+
+def batch_processing(batch_size, columnar=None, prefetch_depth=0):
+  """Process users in batches and print them.
+
+  Row batches are filtered by MySQL. With ``columnar`` set ('numpy' or
+  'arrow') the age >= 25 filter runs as one vectorized mask per batch.
+  A ``prefetch_depth`` above 0 fetches that many batches ahead on a
+  background thread while the current batch is processed.
+  """
+  if columnar is None:
+    batches = stream_users_in_batches(batch_size, min_age=25)  # Filter users with age >= 25 in SQL
+    for batch in prefetch(batches, prefetch_depth):
+      for user in batch:
+        print(user)
+    return
+
+  batches = stream_users_in_batches(batch_size, columnar=columnar)
+  for batch in prefetch(batches, prefetch_depth):
+    batch = filter_columns(batch, age_at_least(batch, 25))
+    for user in column_rows(batch):
+      print(user)
+
+def user_id_ranges(partitions, first=None, last=None, binary_uuid=False):
+  """
+  Split the user_id key space into ``partitions`` disjoint ``(low, high)`` ranges.
+
+  The space between the ``first`` and ``last`` user_id (the whole UUID
+  space by default) is cut into equal slices of the 128-bit UUID value,
+  which orders exactly like the CHAR(36) strings and the BINARY(16) bytes.
+  Bounds are returned in the stored form; the outer ends are left open.
+  """
+  low = uuid.UUID(first).int if first else 0
+  high = uuid.UUID(last).int + 1 if last else 1 << 128
+  bounds = []
+  for i in range(1, partitions):
+    bound = uuid.UUID(int=low + (high - low) * i // partitions)
+    bounds.append(bound.bytes if binary_uuid else str(bound))
+  return list(zip([None] + bounds, bounds + [None]))
+
+def user_id_bounds(connection):
+  """Return the (first, last, binary_uuid) user_id bounds of the table."""
+  binary_uuid = seed.user_id_is_binary(connection)
+  cursor = connection.cursor()
   try:
-    cnx = connector.connect(**config)
-
-    if cnx.is_connected():
-      return cnx
-  except Error as err:
-    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-      print("Wrong username or password")
-    elif err.errno == errorcode.ER_BAD_DB_ERROR:
-      print("Database does not exist")
-    else:
-      print(err)
-  return None
-  
-
-def stream_users_in_batches(batch_size):
-  """Generator function to fetch rows in batches from the user_data table."""
+    cursor.execute("SELECT MIN(user_id), MAX(user_id) FROM user_data")
+    first, last = cursor.fetchone()
+  finally:
+    cursor.close()
+  return seed.user_id_to_str(first), seed.user_id_to_str(last), binary_uuid
+
+# Connection opened once by each pool worker process
+_worker_connection = None
+
+def _init_worker():
+  """Open the connection used by this worker process for all its ranges."""
+  global _worker_connection
+  _worker_connection = connect_db()
+
+def _scan_range(task):
+  """
+  Read up to max_batches batches of one key range inside a worker.
+
+  Rows are read in user_id order, so the rest of the range starts right
+  after the last row returned. Returns the processed batches and the
+  ``(low, high)`` range still to scan, or None once the range is done.
+  """
+  key_range, batch_size, max_batches, min_age, query, process, binary_uuid = task
+  query = query or UserQuery()
+  # user_id is read even when not projected, to know where the range resumes
+  columns = query.columns if 'user_id' in query.columns else ('user_id',) + query.columns
+  scan = UserQuery(columns, query.min_age, query.max_age, query.email, query.email_prefix, order_by='user_id')
+  results = []
+  rows = 0
+  last_user_id = None
+  for batch in stream_users_in_batches(batch_size, key_range, min_age, _worker_connection, query=scan,
+                                       limit=batch_size * max_batches):
+    rows += len(batch)
+    last_user_id = batch[-1]['user_id']
+    if columns is not query.columns:
+      for row in batch:
+        del row['user_id']
+    results.append(process(batch) if process else batch)
+
+  next_low = uuid.UUID(last_user_id).int + 1 if last_user_id else 1 << 128
+  if rows < batch_size * max_batches or next_low == 1 << 128:
+    return results, None
+  return results, (seed.user_id_to_db(str(uuid.UUID(int=next_low)), binary_uuid), key_range[1])
+
+def parallel_stream_users_in_batches(batch_size, workers=None, partitions=None,
+                                     ordered=True, min_age=None, process=None, query=None,
+                                     max_batches=16):
+  """
+  Scan user_data in parallel, one process and one connection per worker.
+
+  The table is split into ``partitions`` user_id ranges between its
+  smallest and largest key (four per worker by default, so slow ranges do
+  not leave workers idle; time-ordered UUIDv7 keys are split evenly over
+  their time span) and each range is read
+  with stream_users_in_batches(). ``process`` is an optional module level
+  function applied to every batch inside the worker; doing the real work
+  there, instead of in the consumer, is what lets throughput scale with the
+  number of cores. Results are yielded in key order when ``ordered`` is True,
+  otherwise as soon as each task completes. ``min_age`` and ``query``
+  filter and project each range as in stream_users_in_batches(); rows are
+  read in user_id order within a range, so ``query``'s ordering is ignored.
+
+  Each worker task reads at most ``max_batches`` batches of a range, in
+  user_id order, and the rest of the range becomes a new task. Only two
+  tasks per worker are submitted at a time, so at most that many task
+  results are buffered however large or slow a range is.
+  """
+  workers = workers or os.cpu_count() or 1
+  partitions = partitions or workers * 4
   connection = connect_db()
   if not connection:
     return None
+  try:
+    first, last, binary_uuid = user_id_bounds(connection)
+  finally:
+    connection.close()
+  if first is None:
+    return None
 
-  cursor = connection.cursor(dictionary=True)
-  cursor.execute("SELECT * FROM user_data")
+  key_ranges = iter(user_id_ranges(partitions, first, last, binary_uuid))
+  window = workers * 2
+  done = queue.SimpleQueue()  # results (or errors) in completion order, for ordered=False
 
-  while True:
-    rows = cursor.fetchmany(batch_size)
-    if not rows:
-      break
-    yield rows
+  with Pool(workers, initializer=_init_worker) as pool:
+    def submit(key_range):
+      task = (key_range, batch_size, max_batches, min_age, query, process, binary_uuid)
+      if ordered:
+        return pool.apply_async(_scan_range, (task,))
+      return pool.apply_async(_scan_range, (task,), callback=done.put, error_callback=done.put)
 
-  cursor.close()
-  connection.close()
+    pending = deque(submit(key_range) for key_range in islice(key_ranges, window))
+    while pending:
+      if ordered:
+        results, rest = pending.popleft().get()
+      else:
+        pending.popleft()  # any task: only the count matters, done gives the finished one
+        outcome = done.get()
+        if isinstance(outcome, BaseException):
+          raise outcome
+        results, rest = outcome
+      # The rest of a range goes first, so ordered results stay in key order
+      if rest is not None:
+        pending.appendleft(submit(rest))
+      else:
+        pending.extend(submit(key_range) for key_range in islice(key_ranges, 1))
+      yield from results
 
-def batch_processing(batch_size):
-  """Process users in batches and print them."""
-  for batch in stream_users_in_batches(batch_size):
-    batch = [user for user in batch if user['age'] >= 25]  # Filter users with age >= 25
+def parallel_batch_processing(batch_size, workers=None, ordered=True):
+  """Process users aged 25 and over in parallel and print them."""
+  for batch in parallel_stream_users_in_batches(batch_size, workers, ordered=ordered, min_age=25):
     for user in batch:
       print(user)
 
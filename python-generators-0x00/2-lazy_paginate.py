@@ -1,45 +1,36 @@
-import mysql.connector as connector
-from mysql.connector import errorcode, Error
-
-# Database configuration
-# Note: Ensure to replace 'prodev', 'password123', 'localhost', and 'ALX_prodev' with your actual database credentials.
-# This configuration is used to connect to the MySQL database.
-config = {
-  'user':'prodev', 
-  'password':'password123',
-  'host':'localhost',
-  'database':'ALX_prodev'
-}
+import base64
+import binascii
+import json
+from mysql.connector import Error
+import db_pool
+import seed
+from user_query import UserQuery
 
 def connect_db():
-  """Connect to database and return the connection object."""
-  try:
-    cnx = connector.connect(**config)
+  """Borrow a connection to the database from the shared pool.
 
-    if cnx.is_connected():
-      return cnx
-  except Error as err:
-    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-      print("Wrong username or password")
-    elif err.errno == errorcode.ER_BAD_DB_ERROR:
-      print("Database does not exist")
-    else:
-      print(err)
-  return None
-
-def paginate_users(page_size, offset=0):
-  """Fetch users from the database with pagination."""
+  Connections are reused across calls, so fetching a page no longer pays
+  for a new TCP and authentication handshake. See db_pool for the settings.
+  """
+  return db_pool.connect()
+
+def paginate_users(page_size, offset=0, query=None):
+  """Fetch users from the database with pagination.
+
+  ``query`` is an optional UserQuery whose columns, predicates and ordering
+  are applied by MySQL.
+  """
   cnx = connect_db()
   if not cnx:
     return []
 
   cursor = cnx.cursor(dictionary=True)
-  query = "SELECT * FROM user_data LIMIT %s OFFSET %s"
+  sql, params = (query or UserQuery()).to_sql(limit=page_size, offset=offset)
   
   try:
-    cursor.execute(query, (page_size, offset))
+    cursor.execute(sql, params)
     rows = cursor.fetchall()
-    return rows
+    return seed.convert_user_rows(rows)
   except Error as err:
     print(f"Error: {err}")
     return []
@@ -47,11 +38,22 @@ def paginate_users(page_size, offset=0):
     cursor.close()
     cnx.close()
 
-def lazy_paginated_users(page_size):
-  """Generator to yield users in a paginated manner."""
+def lazy_paginated_users(page_size, keyset=False, cursor_token=None, query=None):
+  """Generator to yield users in a paginated manner.
+
+  By default pages are fetched with LIMIT/OFFSET. With ``keyset=True`` (or
+  when resuming from a ``cursor_token``) pages are read by seeking on the
+  user_id primary key over a single connection, see lazy_keyset_pages().
+  An optional UserQuery ``query`` filters and projects every page in MySQL.
+  """
+  if keyset or cursor_token is not None:
+    for users, _ in lazy_keyset_pages(page_size, cursor_token, query):
+      yield from users
+    return
+
   offset = 0
   while True:
-    users = paginate_users(page_size, offset)
+    users = paginate_users(page_size, offset, query)
     if not users:
       break
     for user in users:
@@ -59,6 +61,78 @@ def lazy_paginated_users(page_size):
     offset += page_size
 
 
+def encode_cursor(user_id):
+  """Return an opaque cursor token that resumes after the given user_id."""
+  payload = json.dumps({'after': user_id}).encode('utf-8')
+  return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor_token):
+  """Return the user_id stored in a token made by encode_cursor()."""
+  try:
+    payload = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+    return payload['after']
+  except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+    raise ValueError(f"Invalid pagination cursor: {cursor_token!r}") from None
+
+
+def paginate_users_after(cnx, page_size, last_user_id=None, binary_uuid=False, query=None):
+  """Fetch the page of users that follows last_user_id in primary key order.
+
+  The query seeks on the user_id index instead of skipping rows, so every
+  page costs the same no matter how deep into the table it is. Set
+  ``binary_uuid`` when user_id is stored as BINARY(16); ``last_user_id`` is
+  always the string form. A UserQuery ``query`` adds its columns and
+  predicates; it must select user_id and leave the ordering to the seek.
+
+  Database errors are raised rather than returned as an empty page, which
+  would look like the end of the table to a caller walking it.
+  """
+  query = query or UserQuery()
+  if query.user_id_index() is None or query.order_by is not None:
+    raise ValueError("Keyset pagination needs user_id in the columns and no custom order_by")
+  if last_user_id is None:
+    sql, params = query.to_sql(order_by='user_id', limit=page_size)
+  else:
+    sql, params = query.to_sql(["user_id > %s"], [seed.user_id_to_db(last_user_id, binary_uuid)],
+                               order_by='user_id', limit=page_size)
+
+  cursor = cnx.cursor(dictionary=True)
+  try:
+    cursor.execute(sql, params)
+    return seed.convert_user_rows(cursor.fetchall())
+  finally:
+    cursor.close()
+
+
+def lazy_keyset_pages(page_size, cursor_token=None, query=None):
+  """Generator that yields ``(users, next_cursor)`` pages using keyset pagination.
+
+  One connection is opened and reused for every page. ``next_cursor`` is an
+  opaque token: store it once the page has been processed and pass it back
+  as ``cursor_token`` to resume right after that page, e.g. after a crash.
+  ``query`` is passed on to paginate_users_after().
+
+  A failed connection or query raises mysql.connector.Error instead of ending
+  the walk early, so the last stored token still marks the resume point.
+  """
+  last_user_id = decode_cursor(cursor_token) if cursor_token is not None else None
+  cnx = connect_db()
+  if not cnx:
+    raise Error(msg="Could not connect to ALX_prodev for keyset pagination")
+
+  try:
+    binary_uuid = seed.user_id_is_binary(cnx)
+    while True:
+      users = paginate_users_after(cnx, page_size, last_user_id, binary_uuid, query)
+      if not users:
+        break
+      last_user_id = users[-1]['user_id']
+      yield users, encode_cursor(last_user_id)
+  finally:
+    cnx.close()
+
+
 if __name__ == "__main__":
   import sys
   try:
@@ -1,52 +1,77 @@
-import mysql.connector as connector
-from mysql.connector import errorcode, Error
+import db_pool
+from user_query import UserQuery
 # To use a generator ro compute a 
 # memory-efficient aggregate function
 # i.e average age for a large datatset
+#
+# Two aggregation modes are available through age_statistics():
+#   'sql'    - COUNT/AVG/MIN/MAX computed by MySQL, one row over the wire
+#   'stream' - ages read in fetchmany() chunks and folded into a
+#              RunningStats (Welford mean/variance plus a t-digest for
+#              approximate percentiles, which MySQL cannot compute)
 
-config = {
-    'user': 'prodev',
-    'password': 'password123',
-    'host': 'localhost',
-    'database': 'ALX_prodev'
-}
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for use_numpy=True
+    np = None
 
 def connect_db():
-    """Connect to the MySQL engine and return the connection object."""
+    """Borrow a connection to the database from the shared pool."""
+    return db_pool.connect()
+
+def _age_query(query):
+    """Render the SELECT of the ages matching an optional UserQuery."""
+    return (query or UserQuery()).project('age').to_sql()
+
+def stream_user_ages(query=None):
+    """Generator function to fetch user ages from the user_data table.
+
+    ``query`` is an optional UserQuery whose age/email predicates are
+    applied by MySQL; only the age column is ever read.
+    """
+    sql, params = _age_query(query)
+    connection = connect_db()
+    if not connection:
+        return None
+
     try:
-        cnx = connector.connect(**config)
-        if cnx.is_connected():
-            return cnx
-    except Error as err:
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-            print("Wrong username or password")
-        elif err.errno == errorcode.ER_BAD_DB_ERROR:
-            print("Database does not exist")
-        else:
-            print(err)
-    return None
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(sql, params)
+
+        for row in cursor:
+            yield row['age']
 
-def stream_user_ages():
-    """Generator function to fetch user ages from the user_data table."""
+        cursor.close()
+    finally:
+        connection.close()
+
+def stream_user_age_chunks(chunk_size=1000, query=None):
+    """Generator function to fetch user ages in lists of up to chunk_size."""
+    sql, params = _age_query(query)
     connection = connect_db()
     if not connection:
         return None
 
-    cursor = connection.cursor(dictionary=True)
-    cursor.execute("SELECT age FROM user_data")
+    try:
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(sql, params)
 
-    for row in cursor:
-        yield row['age']
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [row[0] for row in rows]
 
-    cursor.close()
-    connection.close()
+        cursor.close()
+    finally:
+        connection.close()
 
 def average_age():
     """Calculate the average age of users using a generator."""
     total_age = 0
     count = 0
 
-    for age in stream_users_ages():
+    for age in stream_user_ages():
         total_age += age
         count += 1
 
@@ -57,6 +82,202 @@ def average_age():
     return avr_age
 
 
+class TDigest:
+    """
+    Mergeable sketch for approximate quantiles in bounded memory.
+
+    Values are buffered and periodically merged into a sorted list of
+    ``(mean, weight)`` centroids. A centroid near quantile q may hold at most
+    ``4 * n * q * (1 - q) / compression`` values, so the tails stay precise
+    while the digest keeps roughly ``compression`` centroids.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.count = 0
+        self._centroids = []
+        self._buffer = []
+
+    def update(self, value):
+        """Add one value to the digest."""
+        self._buffer.append(value)
+        if len(self._buffer) >= self.compression * 10:
+            self._compress()
+
+    def update_many(self, values):
+        """Add an iterable of values to the digest."""
+        self._buffer.extend(values)
+        if len(self._buffer) >= self.compression * 10:
+            self._compress()
+
+    def _compress(self):
+        """Merge the buffered values into the centroid list."""
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + [(value, 1) for value in self._buffer])
+        self.count += len(self._buffer)
+        self._buffer = []
+
+        merged = []
+        cumulative = 0
+        mean, weight = points[0]
+        for point_mean, point_weight in points[1:]:
+            q = (cumulative + (weight + point_weight) / 2) / self.count
+            if weight + point_weight <= max(1, 4 * self.count * q * (1 - q) / self.compression):
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                mean, weight = point_mean, point_weight
+        merged.append((mean, weight))
+        self._centroids = merged
+
+    def quantile(self, q):
+        """Return the approximate value at quantile q (0 <= q <= 1), or None if empty."""
+        self._compress()
+        if not self._centroids:
+            return None
+        target = q * self.count
+        cumulative = 0
+        previous_center = None
+        previous_mean = None
+        for mean, weight in self._centroids:
+            center = cumulative + weight / 2
+            if center >= target:
+                if previous_center is None:
+                    return mean
+                fraction = (target - previous_center) / (center - previous_center)
+                return previous_mean + (mean - previous_mean) * fraction
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        return self._centroids[-1][0]
+
+
+class RunningStats:
+    """
+    Incremental count, mean, variance, min, max and percentiles of a stream.
+
+    Single values use Welford's update; whole chunks are summarised first
+    (with NumPy when ``use_numpy`` is set) and combined with Chan's parallel
+    formula, so every value is visited once and memory does not grow with
+    the stream.
+    """
+
+    def __init__(self, use_numpy=False, compression=100):
+        if use_numpy and np is None:
+            raise ImportError("NumPy is required for use_numpy=True")
+        self.use_numpy = use_numpy
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+        self.digest = TDigest(compression)
+
+    def update(self, value):
+        """Fold a single value into the statistics."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.digest.update(value)
+
+    def update_many(self, values):
+        """Fold a chunk of values into the statistics."""
+        if self.use_numpy:
+            chunk = np.asarray(values, dtype=float)
+            count = int(chunk.size)
+            if not count:
+                return
+            mean = float(chunk.mean())
+            m2 = float(((chunk - mean) ** 2).sum())
+            low, high = float(chunk.min()), float(chunk.max())
+            values = np.sort(chunk).tolist()
+        else:
+            values = list(values)
+            count = len(values)
+            if not count:
+                return
+            mean = sum(values) / count
+            m2 = sum((value - mean) ** 2 for value in values)
+            low, high = min(values), max(values)
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.digest.update_many(values)
+
+    @property
+    def variance(self):
+        """Sample variance, or 0.0 with fewer than two values."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return self.variance ** 0.5
+
+    def percentile(self, p):
+        """Approximate p-th percentile (0-100)."""
+        return self.digest.quantile(p / 100)
+
+
+def sql_age_statistics(query=None):
+    """Return count, mean, min and max of the ages computed by MySQL."""
+    sql = "SELECT COUNT(age), AVG(age), MIN(age), MAX(age) FROM user_data"
+    conditions, params = (query or UserQuery()).conditions()
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    connection = connect_db()
+    if not connection:
+        return None
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, tuple(params))
+        count, mean, low, high = cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+    return {
+        'count': count,
+        'mean': float(mean) if mean is not None else 0.0,
+        'min': low,
+        'max': high,
+    }
+
+def streaming_age_statistics(chunk_size=1000, percentiles=(50, 90, 99), use_numpy=False, query=None):
+    """Return count, mean, stddev, min, max and approximate percentiles of the ages."""
+    stats = RunningStats(use_numpy=use_numpy)
+    for ages in stream_user_age_chunks(chunk_size, query):
+        stats.update_many(ages)
+    return {
+        'count': stats.count,
+        'mean': stats.mean,
+        'stddev': stats.stddev,
+        'min': stats.min,
+        'max': stats.max,
+        'percentiles': {p: stats.percentile(p) for p in percentiles},
+    }
+
+def age_statistics(mode='sql', **kwargs):
+    """Aggregate user ages either in MySQL ('sql') or in a single streaming pass ('stream').
+
+    Both modes accept a UserQuery as ``query`` to aggregate only the matching users.
+    """
+    if mode == 'sql':
+        return sql_age_statistics(**kwargs)
+    if mode == 'stream':
+        return streaming_age_statistics(**kwargs)
+    raise ValueError(f"Unknown aggregation mode: {mode!r}")
+
+
 if __name__ == "__main__":
     import sys
 
@@ -0,0 +1,219 @@
+"""
+  Async generator versions of the user_data generators.
+
+  Each generator reads ahead: a background task fetches the next batches
+  (up to ``prefetch`` of them) while the consumer is still working on the
+  current one, so database latency overlaps with processing instead of
+  adding to it.
+
+  MySQL is reached through aiomysql with unbuffered (server side) cursors.
+  SQLiteBackend runs the same queries against a local SQLite file through
+  aiosqlite, e.g. for tests.
+
+  Example usage:
+    async for user in async_stream_users(batch_size=500):
+      await handle(user)
+
+    backend = SQLiteBackend('users.db')
+    async for batch in async_stream_users_in_batches(100, backend=backend):
+      ...
+"""
+import asyncio
+from contextlib import aclosing, suppress
+import db_pool
+import seed
+from user_query import UserQuery
+
+try:
+  import aiomysql
+except ImportError:  # only needed for MySQLBackend
+  aiomysql = None
+
+try:
+  import aiosqlite
+except ImportError:  # only needed for SQLiteBackend
+  aiosqlite = None
+
+
+class MySQLBackend:
+  """Async MySQL connections using the settings in db_pool.config."""
+
+  def __init__(self, **connect_args):
+    if aiomysql is None:
+      raise ImportError("aiomysql is required for MySQLBackend")
+    settings = {**db_pool.config, **connect_args}
+    settings['db'] = settings.pop('database', None)
+    self.connect_args = settings
+
+  async def connect(self):
+    return await aiomysql.connect(**self.connect_args)
+
+  async def execute(self, cnx, query, params=(), dictionary=True, buffered=False):
+    # Unbuffered cursors stream large results, but leave the connection busy until
+    # every row is read; bounded results that share a connection use buffered ones
+    if buffered:
+      cursor_class = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+    else:
+      cursor_class = aiomysql.SSDictCursor if dictionary else aiomysql.SSCursor
+    cursor = await cnx.cursor(cursor_class)
+    await cursor.execute(query, params)
+    return cursor
+
+  async def close(self, cnx):
+    # Closing the socket also drops any unread rows of an unbuffered cursor,
+    # instead of draining them as closing the cursor would.
+    cnx.close()
+
+
+class SQLiteBackend:
+  """Async SQLite stand-in with the same interface as MySQLBackend."""
+
+  def __init__(self, path):
+    if aiosqlite is None:
+      raise ImportError("aiosqlite is required for SQLiteBackend")
+    self.path = path
+
+  async def connect(self):
+    return await aiosqlite.connect(self.path)
+
+  async def execute(self, cnx, query, params=(), dictionary=True, buffered=False):
+    cursor = await cnx.execute(query.replace('%s', '?'), params)
+    if not dictionary:
+      return cursor
+    return _DictCursor(cursor)
+
+  async def close(self, cnx):
+    await cnx.close()
+
+
+class _DictCursor:
+  """Wrap an aiosqlite cursor so fetchmany() returns dicts like MySQL's dict cursors."""
+
+  def __init__(self, cursor):
+    self._cursor = cursor
+    self._columns = [column[0] for column in cursor.description]
+
+  async def fetchmany(self, size):
+    rows = await self._cursor.fetchmany(size)
+    return [dict(zip(self._columns, row)) for row in rows]
+
+
+async def _read_ahead(batches, prefetch):
+  """
+    Iterate the async generator ``batches`` from a background task.
+    Up to ``prefetch`` batches are buffered ahead of the consumer; with a
+    prefetch of 0 the batches are passed through unchanged. Closing the
+    read-ahead stops the background task and closes ``batches``.
+  """
+  if prefetch <= 0:
+    async with aclosing(batches):
+      async for batch in batches:
+        yield batch
+    return
+
+  queue = asyncio.Queue(prefetch)
+  done = object()
+
+  async def produce():
+    try:
+      async for batch in batches:
+        await queue.put(batch)
+      await queue.put(done)
+    except Exception as err:
+      await queue.put(err)
+    finally:
+      await batches.aclose()
+
+  producer = asyncio.create_task(produce())
+  try:
+    while True:
+      batch = await queue.get()
+      if batch is done:
+        break
+      if isinstance(batch, Exception):
+        raise batch
+      yield batch
+  finally:
+    producer.cancel()
+    with suppress(asyncio.CancelledError):
+      await producer
+
+
+async def _query_batches(backend, query, params, batch_size, dictionary=True):
+  """Run one query and yield its rows batch_size at a time."""
+  cnx = await backend.connect()
+  try:
+    cursor = await backend.execute(cnx, query, params, dictionary)
+    while True:
+      rows = await cursor.fetchmany(batch_size)
+      if not rows:
+        break
+      yield rows
+  finally:
+    await backend.close(cnx)
+
+
+async def async_stream_users_in_batches(batch_size, min_age=None, prefetch=1, backend=None, query=None):
+  """Async generator yielding lists of up to batch_size users, reading ahead.
+  ``query`` is an optional UserQuery applied by the database."""
+  backend = backend or MySQLBackend()
+  conditions, params = (["age >= %s"], [min_age]) if min_age is not None else ([], [])
+  sql, params = (query or UserQuery()).to_sql(conditions, params)
+  # aclosing() stops the read-ahead as soon as this generator is closed,
+  # instead of whenever the abandoned generator is garbage collected
+  async with aclosing(_read_ahead(_query_batches(backend, sql, params, batch_size), prefetch)) as batches:
+    async for rows in batches:
+      yield seed.convert_user_rows(rows)
+
+
+async def async_stream_users(batch_size=1000, prefetch=1, backend=None, query=None):
+  """Async generator yielding users one by one from prefetched batches."""
+  batches = async_stream_users_in_batches(batch_size, prefetch=prefetch, backend=backend, query=query)
+  async with aclosing(batches):
+    async for rows in batches:
+      for row in rows:
+        yield row
+
+
+async def _keyset_pages(backend, page_size, query):
+  """Yield keyset pages over a single connection, seeking on user_id."""
+  if query.user_id_index() is None or query.order_by is not None:
+    raise ValueError("Keyset pagination needs user_id in the columns and no custom order_by")
+  cnx = await backend.connect()
+  try:
+    last_user_id = None
+    while True:
+      if last_user_id is None:
+        sql, params = query.to_sql(order_by='user_id', limit=page_size)
+      else:
+        sql, params = query.to_sql(["user_id > %s"], [last_user_id], order_by='user_id', limit=page_size)
+      # Buffered, so the page is fully read before the next page's query on this connection
+      cursor = await backend.execute(cnx, sql, params, buffered=True)
+      rows = await cursor.fetchmany(page_size)
+      if not rows:
+        break
+      # Seek with the key as stored (bytes for BINARY(16) user_ids)
+      last_user_id = rows[-1]['user_id']
+      yield rows
+  finally:
+    await backend.close(cnx)
+
+
+async def async_lazy_paginated_users(page_size, prefetch=1, backend=None, query=None):
+  """Async generator yielding users page by page; the next page is fetched while the current one is consumed."""
+  backend = backend or MySQLBackend()
+  async with aclosing(_read_ahead(_keyset_pages(backend, page_size, query or UserQuery()), prefetch)) as pages:
+    async for rows in pages:
+      for row in seed.convert_user_rows(rows):
+        yield row
+
+
+async def async_stream_user_ages(chunk_size=1000, prefetch=1, backend=None, query=None):
+  """Async generator yielding user ages, fetched in prefetched chunks."""
+  backend = backend or MySQLBackend()
+  sql, params = (query or UserQuery()).project('age').to_sql()
+  batches = _query_batches(backend, sql, params, chunk_size, dictionary=False)
+  async with aclosing(_read_ahead(batches, prefetch)) as chunks:
+    async for rows in chunks:
+      for row in rows:
+        yield row[0]
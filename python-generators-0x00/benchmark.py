@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+"""
+  Benchmark harness for the user_data access patterns.
+
+  seed      create a synthetic user_data table with --rows rows (1K to 10M)
+            in a separate benchmark database (ALX_prodev_bench by default),
+            so ALX_prodev is left alone.
+  run       time every access pattern (stream_users, stream_users_in_batches,
+            lazy_paginated_users, average_age) for each --batch-sizes value
+            and report rows/sec, time to first row and peak RSS. Results are
+            written as JSON and markdown; with --baseline the run fails when
+            a case regresses by more than --threshold.
+  parallel  compare the range-partitioned process pool scan against a
+            single stream_users_in_batches() scan for 1..N workers.
+
+  Every run case executes in its own process, so its peak RSS is not
+  inflated by the cases before it.
+
+  Usage:
+    python benchmark.py seed --rows 1000000
+    python benchmark.py run --batch-sizes 100 1000 10000 --output report
+    python benchmark.py run --baseline report.json --threshold 0.1
+    python benchmark.py parallel [--batch-size N] [--workers 1 2 4 8]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from functools import partial
+
+import db_pool
+import seed
+
+stream_users = __import__('0-stream_users').stream_users
+batch_processing = __import__('1-batch_processing')
+lazy_paginate = __import__('2-lazy_paginate')
+stream_ages = __import__('4-stream_ages')
+
+BENCH_DATABASE = 'ALX_prodev_bench'
+DEFAULT_BATCH_SIZES = (100, 1000, 10000)
+
+
+def seed_synthetic(rows, database=BENCH_DATABASE, chunk_size=5000, binary_uuid=False):
+  """(Re)create user_data in database with rows synthetic users."""
+  cnx = seed.connect_db()
+  if not cnx:
+    sys.exit(1)
+  cursor = cnx.cursor()
+  cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+  cursor.execute(f"USE `{database}`")
+  cursor.execute("DROP TABLE IF EXISTS user_data")
+  cursor.close()
+  seed.create_table(cnx, binary_uuid=binary_uuid)
+
+  rng = random.Random(42)
+  start = time.perf_counter()
+  cursor = cnx.cursor()
+  for offset in range(0, rows, chunk_size):
+    chunk = [
+      (seed.new_user_id(binary_uuid), f"User {i}", f"user{i}@example.com", rng.randint(1, 120))
+      for i in range(offset, min(offset + chunk_size, rows))
+    ]
+    seed._insert_values(cursor, chunk, upsert=False)
+    cnx.commit()
+  cursor.close()
+  cnx.close()
+  seconds = time.perf_counter() - start
+  print(f"Seeded {rows} rows into {database}.user_data in {seconds:.1f}s.")
+
+
+def _ones(iterable):
+  return (1 for _ in iterable)
+
+
+def _single(func):
+  """Run an aggregate and count the rows it summarised."""
+  result = func()
+  return iter([result['count'] if isinstance(result, dict) else 1])
+
+
+def build_cases(batch_sizes):
+  """
+    Return the benchmark cases as (pattern, mode, batch_size, make_counts).
+    make_counts() returns an iterator yielding how many rows each produced
+    item holds, so row streams and batch streams are measured alike.
+  """
+  cases = [('stream_users', 'fetchone dict', None, lambda: _ones(stream_users()))]
+  for size in batch_sizes:
+    cases += [
+      ('stream_users', 'fetchmany tuple', size,
+       partial(lambda n: _ones(stream_users(chunk_size=n, dictionary=False)), size)),
+      ('stream_users_in_batches', 'dict batches', size,
+       partial(lambda n: map(len, batch_processing.stream_users_in_batches(n)), size)),
+      ('lazy_paginated_users', 'offset', size,
+       partial(lambda n: _ones(lazy_paginate.lazy_paginated_users(n)), size)),
+      ('lazy_paginated_users', 'keyset', size,
+       partial(lambda n: _ones(lazy_paginate.lazy_paginated_users(n, keyset=True)), size)),
+      ('average_age', 'streaming stats', size,
+       partial(lambda n: _single(lambda: stream_ages.age_statistics('stream', chunk_size=n)), size)),
+    ]
+  cases += [
+    ('average_age', 'generator', None, lambda: _ones(stream_ages.stream_user_ages())),
+    ('average_age', 'sql', None, lambda: _single(stream_ages.age_statistics)),
+  ]
+  return cases
+
+
+def _peak_rss_kb():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB on Linux
+
+
+def _run_case(database, batch_sizes, index, limit, results):
+  """Child process body: time one case and send its measurements back."""
+  db_pool.configure(database=database)
+  pattern, mode, batch_size, make_counts = build_cases(batch_sizes)[index]
+  rss_before = _peak_rss_kb()
+  start = time.perf_counter()
+  first = None
+  rows = 0
+  for count in make_counts():
+    if first is None:
+      first = time.perf_counter() - start
+    rows += count
+    if limit and rows >= limit:
+      break
+  seconds = time.perf_counter() - start
+  results.put({
+    'pattern': pattern,
+    'mode': mode,
+    'batch_size': batch_size,
+    'rows': rows,
+    'seconds': round(seconds, 4),
+    'rows_per_sec': round(rows / seconds, 1) if seconds else 0.0,
+    'time_to_first_row': round(first, 4) if first is not None else None,
+    'peak_rss_kb': _peak_rss_kb(),
+    'rss_growth_kb': _peak_rss_kb() - rss_before,
+  })
+
+
+def run_cases(database=BENCH_DATABASE, batch_sizes=DEFAULT_BATCH_SIZES, limit=None):
+  """Run every case in its own process and return the list of results."""
+  context = multiprocessing.get_context('spawn')
+  results = []
+  for index, (pattern, mode, batch_size, _) in enumerate(build_cases(batch_sizes)):
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(database, batch_sizes, index, limit, queue))
+    process.start()
+    process.join()
+    label = f"{pattern:<24}{mode:<18}{str(batch_size or '-'):>7}"
+    if process.exitcode != 0:
+      # The measurements are tiny, so the child never blocks on the queue before exiting
+      results.append({'pattern': pattern, 'mode': mode, 'batch_size': batch_size,
+                      'error': f"exit code {process.exitcode}"})
+      print(f"{label}  failed (exit code {process.exitcode})")
+      continue
+    result = queue.get()
+    results.append(result)
+    print(f"{label}{result['rows_per_sec']:>14.0f} rows/s{result['peak_rss_kb'] / 1024:>9.1f} MiB")
+  return results
+
+
+def _case_key(result):
+  return (result['pattern'], result['mode'], result['batch_size'])
+
+
+def find_regressions(results, baseline, threshold):
+  """Return a message for each case slower, or using more memory, than baseline allows."""
+  previous = {_case_key(result): result for result in baseline['results']}
+  regressions = []
+  for result in results:
+    old = previous.get(_case_key(result))
+    if not old or 'error' in old:
+      continue
+    label = f"{result['pattern']} / {result['mode']} / {result['batch_size']}"
+    if 'error' in result:
+      regressions.append(f"{label}: failed ({result['error']})")
+      continue
+    if result['rows_per_sec'] < old['rows_per_sec'] * (1 - threshold):
+      regressions.append(f"{label}: {result['rows_per_sec']:.0f} rows/s, "
+                         f"baseline {old['rows_per_sec']:.0f} rows/s")
+    if result['peak_rss_kb'] > old['peak_rss_kb'] * (1 + threshold):
+      regressions.append(f"{label}: peak RSS {result['peak_rss_kb']} KiB, "
+                         f"baseline {old['peak_rss_kb']} KiB")
+  return regressions
+
+
+def to_markdown(report):
+  """Render a report as a markdown table."""
+  lines = [
+    f"# user_data benchmark ({report['table_rows']} rows, {report['database']})",
+    "",
+    "| pattern | mode | batch size | rows | rows/sec | first row (s) | peak RSS (MiB) |",
+    "|---|---|---:|---:|---:|---:|---:|",
+  ]
+  for r in report['results']:
+    if 'error' in r:
+      lines.append(f"| {r['pattern']} | {r['mode']} | {r['batch_size'] or '-'} | failed: {r['error']} | | | |")
+      continue
+    first = '-' if r['time_to_first_row'] is None else f"{r['time_to_first_row']:.4f}"
+    lines.append(f"| {r['pattern']} | {r['mode']} | {r['batch_size'] or '-'} | {r['rows']} "
+                 f"| {r['rows_per_sec']:.0f} | {first} | {r['peak_rss_kb'] / 1024:.1f} |")
+  if report.get('regressions'):
+    lines += ["", "## Regressions", ""] + [f"- {message}" for message in report['regressions']]
+  return "\n".join(lines) + "\n"
+
+
+def table_rows(database):
+  db_pool.configure(database=database)
+  cnx = db_pool.connect()
+  if not cnx:
+    sys.exit(1)
+  cursor = cnx.cursor()
+  cursor.execute("SELECT COUNT(*) FROM user_data")
+  (count,) = cursor.fetchone()
+  cursor.close()
+  cnx.close()
+  return count
+
+
+def run_parallel(batch_size, workers):
+  """Compare a serial age >= 25 scan with the parallel scan per worker count."""
+  start = time.perf_counter()
+  rows = sum(len(batch) for batch in batch_processing.stream_users_in_batches(batch_size, min_age=25))
+  serial = rows / (time.perf_counter() - start)
+  print(f"{'serial':<22}{rows:>10}{serial:>14.0f} rows/s{1:>8.2f}x")
+
+  for count in workers:
+    start = time.perf_counter()
+    # len runs inside the workers, so only one integer per batch crosses processes
+    rows = sum(batch_processing.parallel_stream_users_in_batches(
+      batch_size, workers=count, min_age=25, process=len))
+    rate = rows / (time.perf_counter() - start)
+    print(f"{f'parallel, {count} workers':<22}{rows:>10}{rate:>14.0f} rows/s{rate / serial:>8.2f}x")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the user_data generators.")
+  parser.add_argument('--database', default=BENCH_DATABASE,
+                      help=f"database holding the benchmark table (default {BENCH_DATABASE})")
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  seeding = commands.add_parser('seed', help="create a synthetic user_data table")
+  seeding.add_argument('--rows', type=int, default=100000)
+  seeding.add_argument('--binary-uuid', action='store_true')
+
+  run = commands.add_parser('run', help="benchmark every access pattern")
+  run.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES))
+  run.add_argument('--limit', type=int, default=None, help="stop each case after this many rows")
+  run.add_argument('--output', default='benchmark_report',
+                   help="write OUTPUT.json and OUTPUT.md (default benchmark_report)")
+  run.add_argument('--baseline', help="JSON report to compare against")
+  run.add_argument('--threshold', type=float, default=0.1,
+                   help="allowed relative regression against the baseline (default 0.1)")
+
+  parallel = commands.add_parser('parallel', help="compare serial and parallel batch scans")
+  parallel.add_argument('--batch-size', type=int, default=1000)
+  parallel.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+  args = parser.parse_args()
+
+  if args.command == 'seed':
+    seed_synthetic(args.rows, args.database, binary_uuid=args.binary_uuid)
+  elif args.command == 'parallel':
+    db_pool.configure(database=args.database)
+    run_parallel(args.batch_size, args.workers)
+  else:
+    report = {
+      'database': args.database,
+      'table_rows': table_rows(args.database),
+      'batch_sizes': args.batch_sizes,
+      'results': run_cases(args.database, args.batch_sizes, args.limit),
+    }
+    if args.baseline:
+      with open(args.baseline, encoding='utf-8') as f:
+        report['regressions'] = find_regressions(report['results'], json.load(f), args.threshold)
+    with open(args.output + '.json', 'w', encoding='utf-8') as f:
+      json.dump(report, f, indent=2)
+    with open(args.output + '.md', 'w', encoding='utf-8') as f:
+      f.write(to_markdown(report))
+    print(f"Report written to {args.output}.json and {args.output}.md")
+    if report.get('regressions'):
+      print("\n".join(report['regressions']))
+      sys.exit(1)
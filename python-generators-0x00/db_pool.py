@@ -0,0 +1,258 @@
+"""
+  Pooled connections to the ALX_prodev database shared by the generator scripts.
+
+  Opening a MySQL connection costs a TCP and authentication handshake, which
+  dominates short queries such as one page of paginate_users(). connect()
+  hands out connections from a process wide ConnectionPool instead; calling
+  close() on them returns them to the pool, so existing code that closes its
+  connection keeps working unchanged.
+
+  Example usage:
+    cnx = db_pool.connect()
+    cursor = cnx.cursor(dictionary=True)
+    ...
+    cnx.close()  # back to the pool
+    print(db_pool.get_pool().metrics())
+"""
+import os
+import threading
+import time
+from collections import deque
+import mysql.connector as connector
+from mysql.connector import errorcode, Error
+from mysql.connector.errors import PoolError
+
+config = {
+  'user': 'prodev',
+  'password': 'password123',
+  'host': 'localhost',
+  'database': 'ALX_prodev'
+}
+
+
+class PooledConnection:
+  """
+    Connection handed out by a ConnectionPool.
+    Every attribute is forwarded to the underlying MySQL connection, except
+    close(), which gives the connection back to the pool.
+  """
+
+  def __init__(self, pool, cnx, created_at):
+    self._pool = pool
+    self._cnx = cnx
+    self._created_at = created_at
+
+  def __getattr__(self, name):
+    if self._cnx is None:
+      raise PoolError("Connection has already been returned to the pool.")
+    return getattr(self._cnx, name)
+
+  def close(self):
+    """Return the connection to its pool. Calling it again does nothing."""
+    if self._cnx is not None:
+      cnx, self._cnx = self._cnx, None
+      self._pool._release(cnx, self._created_at)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    self.close()
+    return False
+
+
+class ConnectionPool:
+  """
+    Thread safe pool of MySQL connections.
+
+    Args:
+      size: Maximum number of open connections (idle and in use).
+      max_lifetime: Seconds after which a connection is closed and replaced.
+      health_check_interval: Idle seconds after which a connection is pinged
+        before being handed out again.
+      timeout: Seconds get_connection() waits for a free connection before
+        raising PoolError.
+      **connect_args: Arguments for mysql.connector.connect().
+  """
+
+  def __init__(self, size=5, max_lifetime=1800, health_check_interval=30, timeout=30, **connect_args):
+    if size < 1:
+      raise ValueError("Pool size must be at least 1.")
+    self.size = size
+    self.max_lifetime = max_lifetime
+    self.health_check_interval = health_check_interval
+    self.timeout = timeout
+    self.connect_args = connect_args
+    self._reset()
+
+  def _reset(self):
+    """Start with an empty pool, e.g. in a freshly forked process."""
+    self._pid = os.getpid()
+    self._cond = threading.Condition()
+    self._idle = deque()  # (cnx, created_at, returned_at), most recent last
+    self._in_use = 0
+    self._stats = {
+      'created': 0,
+      'discarded': 0,
+      'acquired': 0,
+      'timeouts': 0,
+      'wait_time_total': 0.0,
+      'wait_time_max': 0.0,
+    }
+
+  def _check_fork(self):
+    # Connections inherited through fork share their socket with the parent,
+    # so a child process must never use or close them.
+    if self._pid != os.getpid():
+      self._reset()
+
+  def _open(self):
+    cnx = connector.connect(**self.connect_args)
+    with self._cond:
+      self._stats['created'] += 1
+    return cnx, time.monotonic()
+
+  def _discard(self, cnx):
+    with self._cond:
+      self._stats['discarded'] += 1
+    try:
+      cnx.close()
+    except Error:
+      pass
+
+  def _is_healthy(self, cnx, created_at, returned_at):
+    now = time.monotonic()
+    if self.max_lifetime is not None and now - created_at > self.max_lifetime:
+      return False
+    if now - returned_at > self.health_check_interval:
+      try:
+        cnx.ping(reconnect=False)
+      except Error:
+        return False
+    return True
+
+  def get_connection(self, timeout=None):
+    """
+      Borrow a connection, waiting up to timeout seconds for a free one.
+
+      Returns:
+        PooledConnection: close() it (or use it as a context manager) to
+        return it to the pool.
+    """
+    timeout = self.timeout if timeout is None else timeout
+    start = time.monotonic()
+    deadline = start + timeout
+    with self._cond:
+      self._check_fork()
+      while not self._idle and self._in_use >= self.size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          self._stats['timeouts'] += 1
+          raise PoolError(f"No connection available within {timeout} seconds "
+                          f"(pool size {self.size}).")
+        self._cond.wait(remaining)
+      entry = self._idle.pop() if self._idle else None
+      self._in_use += 1
+      waited = time.monotonic() - start
+      self._stats['acquired'] += 1
+      self._stats['wait_time_total'] += waited
+      self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+    try:
+      if entry is not None:
+        cnx, created_at, returned_at = entry
+        if self._is_healthy(cnx, created_at, returned_at):
+          return PooledConnection(self, cnx, created_at)
+        self._discard(cnx)
+      cnx, created_at = self._open()
+      return PooledConnection(self, cnx, created_at)
+    except BaseException:
+      with self._cond:
+        self._in_use -= 1
+        self._cond.notify()
+      raise
+
+  def _release(self, cnx, created_at):
+    """Take a connection back, discarding it if it cannot be reused safely."""
+    with self._cond:
+      if self._pid != os.getpid():
+        return
+    reusable = self.max_lifetime is None or time.monotonic() - created_at <= self.max_lifetime
+    try:
+      # A half read result set would have to be drained row by row first,
+      # which can be far slower than a new handshake.
+      if getattr(cnx, 'unread_result', False) or not cnx.is_connected():
+        reusable = False
+      elif cnx.in_transaction:
+        cnx.rollback()
+    except Error:
+      reusable = False
+    if not reusable:
+      self._discard(cnx)
+
+    with self._cond:
+      self._in_use -= 1
+      if reusable:
+        self._idle.append((cnx, created_at, time.monotonic()))
+      self._cond.notify()
+
+  def metrics(self):
+    """Return a snapshot of the pool counters."""
+    with self._cond:
+      self._check_fork()
+      stats = dict(self._stats)
+      stats['size'] = self.size
+      stats['in_use'] = self._in_use
+      stats['idle'] = len(self._idle)
+    stats['wait_time_avg'] = stats['wait_time_total'] / stats['acquired'] if stats['acquired'] else 0.0
+    return stats
+
+  def close(self):
+    """Close the idle connections; borrowed ones are closed when returned."""
+    with self._cond:
+      idle, self._idle = list(self._idle), deque()
+      self.max_lifetime = 0
+    for cnx, _, _ in idle:
+      self._discard(cnx)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure(**kwargs):
+  """
+    Replace the shared pool, e.g. configure(size=10, max_lifetime=600).
+    Keyword arguments are ConnectionPool options or connection settings
+    overriding the module config.
+  """
+  global _pool
+  pool_options = {key: kwargs.pop(key) for key in
+                  ('size', 'max_lifetime', 'health_check_interval', 'timeout') if key in kwargs}
+  with _pool_lock:
+    old, _pool = _pool, ConnectionPool(**pool_options, **{**config, **kwargs})
+  if old is not None:
+    old.close()
+  return _pool
+
+def get_pool():
+  """Return the shared pool, creating it with the default settings on first use."""
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ConnectionPool(**config)
+    return _pool
+
+def connect():
+  """Borrow a connection to ALX_prodev from the shared pool, or return None on failure."""
+  try:
+    return get_pool().get_connection()
+  except PoolError as err:
+    print(err)
+  except Error as err:
+    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+      print("Wrong username or password")
+    elif err.errno == errorcode.ER_BAD_DB_ERROR:
+      print("Database does not exist")
+    else:
+      print(err)
+  return None
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""
+  Resumable export of the user_data table to rotating NDJSON, CSV or Parquet files.
+
+  Users are read with keyset pagination (see 2-lazy_paginate.py) and split
+  into files of rows_per_file rows: users-000000.ndjson.gz, users-000001...
+  After each file is complete a checkpoint.json is written next to it with
+  the key to resume after, the total row count and the file's SHA-256.
+  Running the export again with the same directory continues right after
+  the last checkpointed file, so a crash costs at most one file of work.
+
+  Encoding, compression and checkpointing run on a background writer
+  thread fed through a bounded queue, so they overlap with fetching the
+  next pages (zlib, bz2 and lzma release the GIL while compressing).
+
+  If reading the table fails, the error propagates once the files already
+  queued are written, and the checkpoint stays at the last complete file
+  with "complete": false; re-run the export to resume from it.
+
+  Usage:
+    python export_users.py DIRECTORY [--format ndjson|csv|parquet]
+                           [--compress gzip|bz2|xz (ndjson/csv) | snappy|gzip|brotli|zstd|lz4 (parquet)]
+                           [--rows-per-file N]
+"""
+import argparse
+import bz2
+import csv
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import queue
+import threading
+
+lazy_paginate = __import__('2-lazy_paginate')
+
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError:  # PyArrow is optional, only needed for Parquet output
+  pa = pq = None
+
+FORMATS = ('ndjson', 'csv', 'parquet')
+COMPRESSORS = {
+  None: (open, ''),
+  'gzip': (gzip.open, '.gz'),
+  'bz2': (bz2.open, '.bz2'),
+  'xz': (lzma.open, '.xz'),
+}
+# Codecs of pyarrow.parquet.write_table(); None means its default, snappy
+PARQUET_CODECS = (None, 'snappy', 'gzip', 'brotli', 'zstd', 'lz4')
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def load_checkpoint(directory):
+  """Return the saved export state of a directory, or None for a new export."""
+  try:
+    with open(os.path.join(directory, CHECKPOINT_FILE), encoding='utf-8') as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+
+def save_checkpoint(directory, state):
+  """Atomically replace the checkpoint so a crash never leaves half of one."""
+  path = os.path.join(directory, CHECKPOINT_FILE)
+  tmp = path + '.tmp'
+  with open(tmp, 'w', encoding='utf-8') as f:
+    json.dump(state, f, indent=2)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, path)
+
+
+def file_checksum(path):
+  """Return the SHA-256 hex digest of a file."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def write_rows(path, rows, fmt, compress=None):
+  """Write a list of user dicts to path in the given format."""
+  if fmt == 'parquet':
+    if pa is None:
+      raise ImportError("PyArrow is required for Parquet output")
+    pq.write_table(pa.Table.from_pylist(rows), path, compression=compress or 'snappy')
+    return
+
+  opener, _ = COMPRESSORS[compress]
+  with opener(path, 'wt', newline='', encoding='utf-8') as f:
+    if fmt == 'ndjson':
+      for row in rows:
+        f.write(json.dumps(row, default=str))
+        f.write('\n')
+    else:
+      writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+      writer.writeheader()
+      writer.writerows(rows)
+
+
+class ChunkWriter(threading.Thread):
+  """
+    Background thread writing queued chunks to disk, then checkpointing them.
+    Chunks are handled strictly in submission order, so the checkpoint
+    always describes a prefix of the export.
+  """
+
+  def __init__(self, directory, state, fmt, compress, queue_size=2):
+    super().__init__(name='export-writer', daemon=True)
+    self.directory = directory
+    self.state = state
+    self.fmt = fmt
+    self.compress = compress
+    self.error = None
+    self._queue = queue.Queue(queue_size)
+
+  def submit(self, rows):
+    """Queue a chunk, blocking while queue_size chunks are already pending."""
+    if self.error:
+      raise self.error
+    self._queue.put(rows)
+
+  def finish(self):
+    """Wait for the pending chunks and re-raise any writer error."""
+    self._queue.put(None)
+    self.join()
+    if self.error:
+      raise self.error
+
+  def run(self):
+    while True:
+      rows = self._queue.get()
+      if rows is None:
+        return
+      if self.error:
+        continue  # keep draining so submit() never blocks forever
+      try:
+        self._write_chunk(rows)
+      except Exception as err:
+        self.error = err
+
+  def _write_chunk(self, rows):
+    index = len(self.state['files'])
+    if self.fmt == 'parquet':
+      extension = '.parquet'
+    else:
+      extension = '.' + self.fmt + COMPRESSORS[self.compress][1]
+    name = f"users-{index:06d}{extension}"
+    path = os.path.join(self.directory, name)
+    write_rows(path + '.tmp', rows, self.fmt, self.compress)
+    os.replace(path + '.tmp', path)
+
+    last_user_id = rows[-1]['user_id']
+    self.state['files'].append({'name': name, 'rows': len(rows), 'sha256': file_checksum(path)})
+    self.state['rows'] += len(rows)
+    self.state['last_user_id'] = last_user_id
+    self.state['cursor'] = lazy_paginate.encode_cursor(last_user_id)
+    save_checkpoint(self.directory, self.state)
+
+
+def export_users(directory, fmt='ndjson', compress=None, rows_per_file=100000, page_size=1000):
+  """
+    Export user_data into directory, resuming from its checkpoint if there is one.
+
+    Returns:
+      dict: The final checkpoint state (rows, files with checksums, last key).
+
+    Raises:
+      ValueError: For an unknown format or a compression the format does not support.
+      mysql.connector.Error: If reading the table fails; the files written before
+        the failure stay checkpointed and the export can be resumed.
+  """
+  if fmt not in FORMATS:
+    raise ValueError(f"Unknown export format: {fmt!r}")
+  # Check everything the writer needs before fetching, not on the first write
+  if fmt == 'parquet':
+    if compress not in PARQUET_CODECS:
+      raise ValueError(f"Unknown Parquet compression: {compress!r} (use one of "
+                       f"{', '.join(c for c in PARQUET_CODECS if c)})")
+    if pa is None:
+      raise ImportError("PyArrow is required for Parquet output")
+  elif compress not in COMPRESSORS:
+    raise ValueError(f"Unknown compression: {compress!r}")
+  os.makedirs(directory, exist_ok=True)
+
+  state = load_checkpoint(directory)
+  if state is None:
+    state = {'format': fmt, 'compress': compress, 'rows': 0,
+             'last_user_id': None, 'cursor': None, 'files': []}
+  elif (state['format'], state['compress']) != (fmt, compress):
+    raise ValueError(f"{directory} holds a {state['format']} export "
+                     f"(compress={state['compress']}), not {fmt} (compress={compress}).")
+
+  state['complete'] = False
+  save_checkpoint(directory, state)
+
+  writer = ChunkWriter(directory, state, fmt, compress)
+  writer.start()
+  chunk = []
+  try:
+    for users, _ in lazy_paginate.lazy_keyset_pages(page_size, state['cursor']):
+      chunk.extend(users)
+      while len(chunk) >= rows_per_file:
+        writer.submit(chunk[:rows_per_file])
+        chunk = chunk[rows_per_file:]
+    if chunk:
+      writer.submit(chunk)
+  except BaseException:
+    # Keep the complete files already queued; the partial chunk is dropped and
+    # fetched again on resume. The read error matters more than a writer error.
+    try:
+      writer.finish()
+    except Exception:
+      pass
+    raise
+  writer.finish()
+  state['complete'] = True
+  save_checkpoint(directory, state)
+  return state
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Export user_data with resumable checkpoints.")
+  parser.add_argument('directory')
+  parser.add_argument('--format', choices=FORMATS, default='ndjson')
+  parser.add_argument('--compress', choices=sorted({c for c in (*COMPRESSORS, *PARQUET_CODECS) if c}),
+                      default=None)
+  parser.add_argument('--rows-per-file', type=int, default=100000)
+  parser.add_argument('--page-size', type=int, default=1000)
+  args = parser.parse_args()
+
+  result = export_users(args.directory, args.format, args.compress, args.rows_per_file, args.page_size)
+  print(f"Exported {result['rows']} rows into {len(result['files'])} files in {args.directory}.")
@@ -0,0 +1,85 @@
+"""
+  Double-buffered iteration: produce the next items while the current one is processed.
+
+  prefetch() runs any iterator (typically one of the batch generators) on a
+  background thread that keeps up to ``depth`` items queued ahead of the
+  consumer. Fetching batch N+1 from MySQL then overlaps with processing
+  batch N instead of waiting for it; mysql-connector releases the GIL while
+  it waits on the socket.
+
+  Example usage:
+    batches = __import__('1-batch_processing').stream_users_in_batches(1000)
+    for batch in prefetch(batches, depth=2):
+      process(batch)
+
+  Stopping early is safe: when the prefetch generator is closed (explicitly,
+  by garbage collection, or via contextlib.closing around an islice), the
+  worker thread stops, closes the source generator, which closes its cursor
+  and returns its connection, and is joined before close() returns.
+"""
+import queue
+import threading
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+def _put(items, item, stop):
+  """Put item on the bounded queue unless stop is set; return False when stopped."""
+  while not stop.is_set():
+    try:
+      items.put(item, timeout=_POLL_SECONDS)
+      return True
+    except queue.Full:
+      continue
+  return False
+
+
+def prefetch(iterable, depth=2):
+  """
+    Generator yielding the items of iterable, produced ahead on a background thread.
+
+    Args:
+      iterable: Source of items; if it is a generator it is closed on the
+        worker thread when iteration ends or the consumer stops.
+      depth: Maximum number of items buffered ahead of the consumer. The
+        worker blocks once the buffer is full (backpressure). A depth below
+        1 iterates the source directly.
+
+    Exceptions raised by the source are re-raised in the consumer.
+  """
+  if depth < 1:
+    yield from iterable
+    return
+
+  items = queue.Queue(depth)
+  stop = threading.Event()
+  errors = []
+
+  def produce():
+    source = iter(iterable)
+    try:
+      for item in source:
+        if not _put(items, item, stop):
+          return
+    except Exception as err:
+      errors.append(err)
+    finally:
+      close = getattr(source, 'close', None)
+      if close is not None:
+        close()
+      _put(items, _DONE, stop)
+
+  worker = threading.Thread(target=produce, name='prefetch', daemon=True)
+  worker.start()
+  try:
+    while True:
+      item = items.get()
+      if item is _DONE:
+        break
+      yield item
+    if errors:
+      raise errors[0]
+  finally:
+    stop.set()
+    worker.join()
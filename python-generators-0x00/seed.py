@@ -1,7 +1,17 @@
 import mysql.connector as connector
-from mysql.connector import errorcode, Error
+from mysql.connector import errorcode, DataError, Error, IntegrityError
 import uuid
 import csv
+import io
+import mmap
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing import Pool
+import db_pool
 
 
 config = {
@@ -36,41 +46,52 @@ def create_database(cnx):
     print(f'Error creating database: {err}')
 
 def connect_to_prodev():
-  """Connect to the ALX_prodev database."""
-  try:
-    config['database'] = 'ALX_prodev'  # Set the database to connect to
-    cnx = connector.connect(**config)
-    if cnx.is_connected():
-      # print("Connected to ALX_prodev database.")
-      return cnx
-  except Error as err:
-    if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-      print("Wrong username or password")
-    elif err.errno == errorcode.ER_BAD_DB_ERROR:
-      print("Database does not exist")
-    else:
-      print(err)
-      return None
+  """Connect to the ALX_prodev database through the shared connection pool."""
+  return db_pool.connect()
     
-def create_table(cnx):
+def create_table(cnx, binary_uuid=False):
   """
     Create the users table in the ALX_prodev database.
     MYSQL doesn't support UUID, to use UUIDS, use char(36) or binary(16).
-    Here, we use UUID as a string (char(36)).
+    By default, we use UUID as a string (char(36)).
+
+    With binary_uuid, user_id is stored as BINARY(16), which makes the
+    primary key (and every secondary index, which embeds it) less than half
+    the size. That variant also drops the indexes duplicating the primary
+    key and the UNIQUE email constraint.
+
+    Both variants record changes for incremental sync (see sync_users.py):
+    updated_at is refreshed by MySQL on every insert and update, and a
+    trigger leaves a tombstone in user_data_tombstones for every delete.
   """
   try:
-    create_table_query = """
-      CREATE TABLE IF NOT EXISTS user_data (
-        user_id CHAR(36) PRIMARY KEY,
-        name VARCHAR(100) NOT NULL,
-        email VARCHAR(100) NOT NULL UNIQUE,
-        age INT NOT NULL,
-        INDEX idx_users_email (email),
-        INDEX idx_users_user_id (user_id)
-      )
-    """
+    if binary_uuid:
+      create_table_query = """
+        CREATE TABLE IF NOT EXISTS user_data (
+          user_id BINARY(16) PRIMARY KEY,
+          name VARCHAR(100) NOT NULL,
+          email VARCHAR(100) NOT NULL UNIQUE,
+          age INT NOT NULL,
+          updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+          INDEX idx_user_data_updated_at (updated_at, user_id)
+        )
+      """
+    else:
+      create_table_query = """
+        CREATE TABLE IF NOT EXISTS user_data (
+          user_id CHAR(36) PRIMARY KEY,
+          name VARCHAR(100) NOT NULL,
+          email VARCHAR(100) NOT NULL UNIQUE,
+          age INT NOT NULL,
+          updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+          INDEX idx_users_email (email),
+          INDEX idx_users_user_id (user_id),
+          INDEX idx_user_data_updated_at (updated_at, user_id)
+        )
+      """
     cursor = cnx.cursor()
     cursor.execute(create_table_query)
+    create_tombstones(cursor, binary_uuid)
     print("Table user_data created successfully.")
     cursor.close()
   except Error as err:
@@ -84,15 +105,134 @@ def create_table(cnx):
     else:
       print(f'Error creating table: {err}')
 
-def insert_data(connection, data):
-  """Insert data into the users table."""
+def create_tombstones(cursor, binary_uuid=False):
+  """Create the user_data_tombstones table and the delete trigger filling it."""
+  user_id_type = "BINARY(16)" if binary_uuid else "CHAR(36)"
+  cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS user_data_tombstones (
+      user_id {user_id_type} PRIMARY KEY,
+      deleted_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+      INDEX idx_user_data_tombstones_deleted_at (deleted_at, user_id)
+    )
+  """)
+  cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS user_data_tombstone
+    AFTER DELETE ON user_data FOR EACH ROW
+      INSERT INTO user_data_tombstones (user_id, deleted_at)
+      VALUES (OLD.user_id, CURRENT_TIMESTAMP(6))
+      ON DUPLICATE KEY UPDATE deleted_at = VALUES(deleted_at)
+  """)
+
+def enable_change_tracking(cnx):
+  """
+    Add change tracking to a user_data table created before it existed:
+    the updated_at column and index, the tombstone table and its trigger.
+  """
+  try:
+    cursor = cnx.cursor()
+    cursor.execute(
+      "SELECT COUNT(*) FROM information_schema.COLUMNS "
+      "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'user_data' AND COLUMN_NAME = 'updated_at'"
+    )
+    if not cursor.fetchone()[0]:
+      cursor.execute("""
+        ALTER TABLE user_data
+          ADD COLUMN updated_at TIMESTAMP(6) NOT NULL
+            DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+          ADD INDEX idx_user_data_updated_at (updated_at, user_id)
+      """)
+    create_tombstones(cursor, user_id_is_binary(cnx))
+    cnx.commit()
+    print("Change tracking enabled on user_data.")
+    cursor.close()
+  except Error as err:
+    print(f'Error enabling change tracking: {err}')
+
+def uuid7():
+  """
+    Return a time-ordered version 7 UUID (RFC 9562).
+    The first 48 bits are the Unix time in milliseconds, so new keys sort
+    after existing ones and InnoDB appends to the end of the primary key
+    instead of splitting pages at random positions.
+  """
+  timestamp = time.time_ns() // 1_000_000
+  value = (timestamp & 0xFFFFFFFFFFFF) << 80 | int.from_bytes(os.urandom(10), 'big')
+  value = (value & ~(0xF << 76)) | (0x7 << 76)  # version 7
+  value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+  return uuid.UUID(int=value)
+
+def new_user_id(binary_uuid=False, time_ordered=False):
+  """Generate a user_id as a string, or as 16 bytes for a BINARY(16) column."""
+  value = uuid7() if time_ordered else uuid.uuid4()
+  return value.bytes if binary_uuid else str(value)
+
+def user_id_to_str(value):
+  """Return the string form of a user_id read from either schema variant."""
+  if isinstance(value, (bytes, bytearray)):
+    return str(uuid.UUID(bytes=bytes(value)))
+  return value
+
+def user_id_to_db(value, binary_uuid):
+  """Return a string user_id in the form stored by the schema variant."""
+  return uuid.UUID(value).bytes if binary_uuid else value
+
+def convert_user_row(row, user_id_index=0):
+  """Return a user_data row (dict or tuple) with a string user_id.
+  ``user_id_index`` is the position of user_id in tuple rows (None when the
+  row has no user_id)."""
+  if isinstance(row, dict):
+    if isinstance(row.get('user_id'), (bytes, bytearray)):
+      row['user_id'] = user_id_to_str(row['user_id'])
+    return row
+  i = user_id_index
+  if row and i is not None and isinstance(row[i], (bytes, bytearray)):
+    return tuple(row[:i]) + (user_id_to_str(row[i]),) + tuple(row[i + 1:])
+  return row
+
+def convert_user_rows(rows, user_id_index=0):
+  """Return a batch of user_data rows with string user_ids.
+  The schema variant is detected from the first row, so CHAR(36) batches
+  are returned untouched."""
+  if not rows:
+    return rows
+  first = rows[0]
+  if isinstance(first, dict):
+    user_id = first.get('user_id')
+  else:
+    user_id = first[user_id_index] if user_id_index is not None else None
+  if not isinstance(user_id, (bytes, bytearray)):
+    return rows
+  return [convert_user_row(row, user_id_index) for row in rows]
+
+def user_id_is_binary(cnx):
+  """Return True when user_data.user_id uses the BINARY(16) variant."""
+  cursor = cnx.cursor()
+  try:
+    cursor.execute(
+      "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+      "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'user_data' AND COLUMN_NAME = 'user_id'"
+    )
+    row = cursor.fetchone()
+  finally:
+    cursor.close()
+  if not row:
+    return False
+  data_type = row[0].decode() if isinstance(row[0], (bytes, bytearray)) else row[0]
+  return data_type.lower() == 'binary'
+
+def insert_data(connection, data, binary_uuid=False, time_ordered=False):
+  """
+    Insert data into the users table.
+    Set binary_uuid for a table created with create_table(binary_uuid=True)
+    and time_ordered to generate UUIDv7 keys instead of random UUIDv4 ones.
+  """
   try:
     cursor = connection.cursor()
     with open(data, mode='r', newline='', encoding='utf-8') as csvfile:
       reader = csv.DictReader(csvfile)
       data_to_insert = [
         (
-          str(uuid.uuid4()),  # Generate a new UUID for user_id
+          new_user_id(binary_uuid, time_ordered),  # Generate a new UUID for user_id
           row['name'],
           row['email'],
           float(row['age'])
@@ -123,6 +263,318 @@ def insert_data(connection, data):
     print(f'An unexpected error occurred: {e}')
 
 
+USER_COLUMNS = ('user_id', 'name', 'email', 'age')
+PARSE_ERRORS = (KeyError, ValueError, AttributeError, TypeError)
+
+def parse_user_row(row, binary_uuid=False, time_ordered=False):
+  """
+    Validate one CSV row and return it as a (user_id, name, email, age) tuple.
+    Raises KeyError or ValueError describing the problem for bad rows.
+  """
+  name = row['name'].strip()
+  email = row['email'].strip()
+  if not name or len(name) > 100:
+    raise ValueError(f"invalid name {row['name']!r}")
+  if '@' not in email or len(email) > 100:
+    raise ValueError(f"invalid email {row['email']!r}")
+  age = float(row['age'])
+  if age < 0 or not age.is_integer():
+    raise ValueError(f"invalid age {row['age']!r}")
+  return (new_user_id(binary_uuid, time_ordered), name, email, int(age))
+
+def _is_row_error(err):
+  """True when err is caused by the values of a row rather than the connection or the server."""
+  return isinstance(err, (DataError, IntegrityError)) or err.errno in (
+    errorcode.ER_TRUNCATED_WRONG_VALUE_FOR_FIELD, errorcode.ER_TRUNCATED_WRONG_VALUE,
+    errorcode.ER_WARN_DATA_OUT_OF_RANGE, errorcode.ER_DATA_TOO_LONG)
+
+def _insert_values(cursor, rows, upsert):
+  """Insert rows with a single multi-row INSERT statement."""
+  placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+  query = f"INSERT INTO user_data ({', '.join(USER_COLUMNS)}) VALUES {placeholders}"
+  if upsert:
+    # Keep the existing user_id of a known email, refresh the other fields
+    query += " ON DUPLICATE KEY UPDATE name = VALUES(name), age = VALUES(age)"
+  cursor.execute(query, [value for row in rows for value in row])
+
+def _load_data_infile(cursor, rows, upsert):
+  """Insert rows by streaming them to the server with LOAD DATA LOCAL INFILE."""
+  binary_uuid = bool(rows) and isinstance(rows[0][0], bytes)
+  with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', encoding='utf-8', delete=False) as tmp:
+    writer = csv.writer(tmp, lineterminator='\n')
+    if binary_uuid:
+      writer.writerows((row[0].hex(),) + row[1:] for row in rows)
+    else:
+      writer.writerows(rows)
+  try:
+    columns = "(@user_id, name, email, age) SET user_id = UNHEX(@user_id)" if binary_uuid \
+      else f"({', '.join(USER_COLUMNS)})"
+    if not upsert:
+      cursor.execute(
+        "LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE user_data "
+        "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+        f"LINES TERMINATED BY '\\n' {columns}",
+        (tmp.name,)
+      )
+      return
+    # LOAD DATA ... REPLACE would delete and re-insert known emails, giving them a
+    # new user_id and a tombstone. Load into a per-session staging table instead,
+    # then upsert from it exactly like _insert_values() does.
+    cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS user_data_staging LIKE user_data")
+    cursor.execute("DELETE FROM user_data_staging")
+    cursor.execute(
+      "LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE user_data_staging "
+      "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+      f"LINES TERMINATED BY '\\n' {columns}",
+      (tmp.name,)
+    )
+    cursor.execute(
+      f"INSERT INTO user_data ({', '.join(USER_COLUMNS)}) "
+      f"SELECT {', '.join(USER_COLUMNS)} FROM user_data_staging "
+      "ON DUPLICATE KEY UPDATE name = VALUES(name), age = VALUES(age)"
+    )
+  finally:
+    os.remove(tmp.name)
+
+class _ChunkLoader:
+  """
+    Inserts chunks of parsed rows for the bulk loaders, committing after
+    each one, and records the rows that cannot be loaded in a reject file.
+  """
+
+  def __init__(self, connection, upsert, use_load_data, reject_file):
+    self.connection = connection
+    self.cursor = connection.cursor()
+    self.upsert = upsert
+    self.use_load_data = use_load_data
+    self.reject_file = reject_file
+    self.stats = {'inserted': 0, 'rejected': 0, 'seconds': 0.0, 'rows_per_sec': 0.0}
+    self._rejects = None
+    self._reject_writer = None
+
+  def reject(self, row, reason):
+    """Write a CSV row (dict) and the reason it was rejected to the reject file."""
+    if self._reject_writer is None:
+      self._rejects = open(self.reject_file, mode='w', newline='', encoding='utf-8')
+      self._reject_writer = csv.writer(self._rejects)
+      self._reject_writer.writerow(['name', 'email', 'age', 'error'])
+    self._reject_writer.writerow([row.get('name'), row.get('email'), row.get('age'), reason])
+    self.stats['rejected'] += 1
+
+  def flush(self, chunk):
+    """Insert a list of (user_id, name, email, age) tuples and commit."""
+    try:
+      if self.use_load_data:
+        try:
+          _load_data_infile(self.cursor, chunk, self.upsert)
+        except Error as err:
+          if err.errno not in (errorcode.ER_NOT_ALLOWED_COMMAND, errorcode.ER_CLIENT_LOCAL_FILES_DISABLED,
+                               errorcode.CR_LOAD_DATA_LOCAL_INFILE_REJECTED):
+            raise
+          print(f"LOAD DATA LOCAL INFILE unavailable ({err}), using multi-row INSERT.")
+          self.use_load_data = False
+          _insert_values(self.cursor, chunk, self.upsert)
+      else:
+        _insert_values(self.cursor, chunk, self.upsert)
+      self.connection.commit()
+      self.stats['inserted'] += len(chunk)
+    except Error as err:
+      # A lost connection or a server error would fail every row the same way; stop the load
+      if not _is_row_error(err):
+        raise
+      # Retry the failed chunk row by row so only the offending rows are rejected
+      self.connection.rollback()
+      for values in chunk:
+        try:
+          _insert_values(self.cursor, [values], self.upsert)
+          self.connection.commit()
+          self.stats['inserted'] += 1
+        except Error as err:
+          if not _is_row_error(err):
+            raise
+          self.connection.rollback()
+          self.reject(dict(zip(USER_COLUMNS[1:], values[1:])), str(err))
+
+  def close(self, start):
+    """Close the cursor and reject file, then report and return the stats."""
+    self.cursor.close()
+    if self._rejects:
+      self._rejects.close()
+    stats = self.stats
+    stats['seconds'] = time.perf_counter() - start
+    if stats['seconds']:
+      stats['rows_per_sec'] = stats['inserted'] / stats['seconds']
+    print(f"{stats['inserted']} rows loaded, {stats['rejected']} rejected "
+          f"in {stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} rows/sec).")
+    if stats['rejected']:
+      print(f"Rejected rows written to {self.reject_file}.")
+    return stats
+
+def bulk_insert_data(connection, data, chunk_size=1000, upsert=True, reject_file=None, use_load_data=False,
+                     binary_uuid=False, time_ordered=False):
+  """
+    Stream a CSV file into user_data in chunks, committing after each chunk.
+
+    Rows are read and validated one at a time, so memory is bounded by
+    chunk_size rather than by the file size. Each chunk is written with a
+    multi-row INSERT (or LOAD DATA LOCAL INFILE when use_load_data is set and
+    the server allows it, which needs allow_local_infile=True on the
+    connection). With upsert, rows whose email already exists are updated
+    and keep their user_id, with either method, so the load can be re-run
+    safely.
+
+    Invalid rows, and rows the server rejects for their values, are written
+    with the reason to reject_file (<data>_rejects.csv by default) instead of
+    aborting the load. Other errors, such as a lost connection, stop the load
+    and are raised; the chunks committed before stay loaded. binary_uuid and time_ordered choose the user_id format as in
+    insert_data(). Returns a dict with the inserted/rejected counts and
+    rows/sec.
+  """
+  if reject_file is None:
+    reject_file = os.path.splitext(data)[0] + '_rejects.csv'
+
+  start = time.perf_counter()
+  loader = _ChunkLoader(connection, upsert, use_load_data, reject_file)
+  try:
+    with open(data, mode='r', newline='', encoding='utf-8') as csvfile:
+      chunk = []
+      for row in csv.DictReader(csvfile):
+        try:
+          chunk.append(parse_user_row(row, binary_uuid, time_ordered))
+        except PARSE_ERRORS as e:
+          loader.reject(row, str(e))
+          continue
+        if len(chunk) >= chunk_size:
+          loader.flush(chunk)
+          chunk = []
+      if chunk:
+        loader.flush(chunk)
+  except FileNotFoundError:
+    print(f'File {data} not found.')
+  finally:
+    # Also on a connection error, which is raised after the chunks committed so far are reported
+    stats = loader.close(start)
+  return stats
+
+# File mapped by each parser process, see _init_parser()
+_parser_file = None
+_parser_map = None
+
+def _init_parser(data):
+  """Map the CSV file once in each parser process."""
+  global _parser_file, _parser_map
+  _parser_file = open(data, 'rb')
+  _parser_map = mmap.mmap(_parser_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _parse_csv_range(task):
+  """Parse and validate the CSV lines in one byte range; return (rows, rejects)."""
+  start, end, fieldnames, binary_uuid, time_ordered = task
+  text = _parser_map[start:end].decode('utf-8')
+  rows = []
+  rejects = []
+  for row in csv.DictReader(io.StringIO(text, newline=''), fieldnames=fieldnames):
+    try:
+      rows.append(parse_user_row(row, binary_uuid, time_ordered))
+    except PARSE_ERRORS as e:
+      rejects.append((row, str(e)))
+  return rows, rejects
+
+def csv_byte_ranges(mapped, chunk_bytes):
+  """
+    Split a mapped CSV file after its header line into (start, end) byte
+    ranges of about chunk_bytes, each ending on a line boundary.
+  """
+  if chunk_bytes < 1:
+    raise ValueError("chunk_bytes must be at least 1.")
+  size = len(mapped)
+  position = mapped.find(b'\n') + 1 or size
+  ranges = []
+  while position < size:
+    end = mapped.find(b'\n', min(position + chunk_bytes, size) - 1)
+    end = size if end == -1 else end + 1
+    ranges.append((position, end))
+    position = end
+  return ranges
+
+def parallel_bulk_insert_data(connection, data, workers=None, chunk_bytes=1 << 20, chunk_size=1000,
+                              upsert=True, reject_file=None, use_load_data=False,
+                              binary_uuid=False, time_ordered=False):
+  """
+    Load a CSV file like bulk_insert_data(), parsing it on a process pool.
+
+    The file is memory-mapped and cut at line boundaries into ranges of
+    about chunk_bytes. Worker processes parse and validate the ranges while
+    a writer thread inserts the rows already parsed, chunk_size rows per
+    statement, so parsing overlaps with the database writes. Ranges are
+    loaded in file order and at most two per worker are parsed ahead of the
+    writer, which bounds memory. Quoted fields must not contain line breaks,
+    as the file is split on them. Returns the same stats as
+    bulk_insert_data(). Raises ValueError if chunk_bytes is below 1.
+  """
+  if reject_file is None:
+    reject_file = os.path.splitext(data)[0] + '_rejects.csv'
+  workers = workers or os.cpu_count() or 1
+
+  start = time.perf_counter()
+  try:
+    with open(data, 'rb') as f:
+      if not os.fstat(f.fileno()).st_size:
+        print("No data to insert.")
+        return None
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header = mapped[:mapped.find(b'\n') + 1 or len(mapped)].decode('utf-8')
+        ranges = csv_byte_ranges(mapped, chunk_bytes)
+  except FileNotFoundError:
+    print(f'File {data} not found.')
+    return None
+  fieldnames = next(csv.reader([header.rstrip('\r\n')]))
+  tasks = [(low, high, fieldnames, binary_uuid, time_ordered) for low, high in ranges]
+
+  loader = _ChunkLoader(connection, upsert, use_load_data, reject_file)
+  parsed = queue.Queue(workers)
+  errors = []
+
+  def write():
+    while True:
+      item = parsed.get()
+      if item is None:
+        return
+      if errors:
+        continue  # keep draining so the parser side never blocks
+      rows, rejects = item
+      try:
+        for row, reason in rejects:
+          loader.reject(row, reason)
+        for i in range(0, len(rows), chunk_size):
+          loader.flush(rows[i:i + chunk_size])
+      except Exception as err:
+        errors.append(err)
+
+  try:
+    # The pool forks before the writer thread starts
+    with Pool(workers, initializer=_init_parser, initargs=(data,)) as pool:
+      writer = threading.Thread(target=write, name='seed-writer', daemon=True)
+      writer.start()
+      try:
+        pending = deque()
+        for task in tasks:
+          if errors:
+            break
+          pending.append(pool.apply_async(_parse_csv_range, (task,)))
+          if len(pending) >= 2 * workers:
+            parsed.put(pending.popleft().get())
+        while pending and not errors:
+          parsed.put(pending.popleft().get())
+      finally:
+        parsed.put(None)
+        writer.join()
+  finally:
+    stats = loader.close(start)
+  if errors:
+    raise errors[0]
+  return stats
+
+
 if __name__ == "__main__":
   connection = connect_db()
   if connection:
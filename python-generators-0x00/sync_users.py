@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+"""
+  Incremental (change data capture) sync of the user_data table.
+
+  Instead of re-reading the whole table, stream_user_changes() yields only
+  the rows inserted or updated, and the users deleted, since the previous
+  run. It relies on the change tracking set up by seed.create_table() (or
+  seed.enable_change_tracking() for older tables): the indexed updated_at
+  column and the user_data_tombstones table filled by a delete trigger.
+
+  Progress is kept as a high-water mark, the last (timestamp, user_id)
+  pair seen for changes and for deletes, in a small JSON state file. It is
+  saved after the consumer has taken every row of a batch, so an
+  interrupted sync repeats at most one batch (at-least-once delivery).
+
+  The at-least-once guarantee has a limit. updated_at and deleted_at are
+  stamped when the statement runs, not when its transaction commits, so
+  rows stamped less than lag_seconds ago are left for the next run. A row
+  whose transaction commits more than lag_seconds after its stamp falls
+  behind a high-water mark that has already moved past it, and is never
+  synced. Set the lag (--lag-seconds) above the longest write transaction
+  on user_data.
+
+  Tombstones are kept until purge_tombstones() (--purge-tombstones)
+  deletes the ones older than the saved deletes mark.
+
+  Usage:
+    for kind, value in stream_user_changes('cache_sync.json'):
+      if kind == 'upsert':
+        cache.put(value['user_id'], value)
+      else:
+        cache.delete(value)
+
+    python sync_users.py [STATE_FILE] [--lag-seconds S] [--batch-size N] [--purge-tombstones]
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+import db_pool
+import seed
+
+# Rows stamped within this many seconds of the database clock are left for
+# the next run, so transactions that commit up to this late are not skipped.
+DEFAULT_LAG_SECONDS = 1.0
+
+
+def load_state(path):
+  """Return the saved high-water marks, or an empty state for a first sync."""
+  try:
+    with open(path, encoding='utf-8') as f:
+      state = json.load(f)
+  except FileNotFoundError:
+    return {'changes': None, 'deletes': None}
+  for key in ('changes', 'deletes'):
+    if state.get(key):
+      state[key] = [datetime.fromisoformat(state[key][0]), state[key][1]]
+  return state
+
+
+def save_state(path, state):
+  """Atomically persist the high-water marks."""
+  serialisable = {key: [mark[0].isoformat(), mark[1]] if mark else None for key, mark in state.items()}
+  tmp = path + '.tmp'
+  with open(tmp, 'w', encoding='utf-8') as f:
+    json.dump(serialisable, f)
+  os.replace(tmp, path)
+
+
+def _seek(cnx, query, stamp_column, mark, upper, batch_size, binary_uuid):
+  """Yield batches of rows after mark and before upper, in (stamp_column, user_id) order."""
+  while True:
+    cursor = cnx.cursor(dictionary=True)
+    if mark is None:
+      cursor.execute(query.format(after="1 = 1"), (upper, batch_size))
+    else:
+      cursor.execute(query.format(after=f"({stamp_column}, user_id) > (%s, %s)"),
+                     (mark[0], seed.user_id_to_db(mark[1], binary_uuid), upper, batch_size))
+    rows = seed.convert_user_rows(cursor.fetchall())
+    cursor.close()
+    if not rows:
+      return
+    mark = [rows[-1]['stamp'], rows[-1]['user_id']]
+    yield rows, mark
+
+
+CHANGES_QUERY = (
+  "SELECT user_id, name, email, age, updated_at, updated_at AS stamp FROM user_data "
+  "WHERE {after} AND updated_at < %s ORDER BY updated_at, user_id LIMIT %s"
+)
+DELETES_QUERY = (
+  "SELECT user_id, deleted_at AS stamp FROM user_data_tombstones "
+  "WHERE {after} AND deleted_at < %s ORDER BY deleted_at, user_id LIMIT %s"
+)
+
+
+def stream_user_changes(state_file='user_sync_state.json', batch_size=1000,
+                        lag_seconds=DEFAULT_LAG_SECONDS, include_deletes=True):
+  """
+    Generator yielding the user_data changes since the last sync.
+
+    Yields ('upsert', user) for every inserted or updated row (a dict with
+    user_id, name, email, age and updated_at), then ('delete', user_id) for
+    every deleted user. The first run, without a state file, yields every
+    row. Both scans seek on the (timestamp, user_id) indexes batch_size
+    rows at a time over one pooled connection.
+
+    Rows stamped in the last lag_seconds are left for the next run; a row
+    committed more than lag_seconds after its stamp is missed (see the
+    module docstring).
+  """
+  state = load_state(state_file)
+  cnx = db_pool.connect()
+  if not cnx:
+    return
+
+  try:
+    binary_uuid = seed.user_id_is_binary(cnx)
+    cursor = cnx.cursor()
+    cursor.execute("SELECT CURRENT_TIMESTAMP(6) - INTERVAL %s MICROSECOND", (int(lag_seconds * 1e6),))
+    (upper,) = cursor.fetchone()
+    cursor.close()
+
+    for rows, mark in _seek(cnx, CHANGES_QUERY, 'updated_at', state['changes'], upper, batch_size, binary_uuid):
+      for row in rows:
+        del row['stamp']
+        yield 'upsert', row
+      state['changes'] = mark
+      save_state(state_file, state)
+
+    if include_deletes:
+      for rows, mark in _seek(cnx, DELETES_QUERY, 'deleted_at', state['deletes'], upper, batch_size, binary_uuid):
+        for row in rows:
+          yield 'delete', row['user_id']
+        state['deletes'] = mark
+        save_state(state_file, state)
+  finally:
+    cnx.close()
+
+
+def purge_tombstones(state_file='user_sync_state.json', batch_size=1000):
+  """
+    Delete the tombstones older than the deletes high-water mark of state_file.
+
+    The consumer of state_file has already seen them. This is only safe when
+    it is the only consumer of the tombstones; with several, purge with the
+    state file whose mark is oldest. Tombstones are deleted batch_size at a
+    time, each batch in its own transaction, so the trigger's inserts are
+    never blocked for long.
+
+    Returns:
+      int: The number of tombstones deleted.
+  """
+  mark = load_state(state_file)['deletes']
+  if mark is None:
+    return 0
+  cnx = db_pool.connect()
+  if not cnx:
+    return 0
+
+  deleted = 0
+  try:
+    cursor = cnx.cursor()
+    try:
+      while True:
+        # Strictly older: tombstones sharing the mark's timestamp may not all be seen yet
+        cursor.execute("DELETE FROM user_data_tombstones WHERE deleted_at < %s LIMIT %s", (mark[0], batch_size))
+        cnx.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+          break
+    finally:
+      cursor.close()
+  finally:
+    cnx.close()
+  return deleted
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Stream the user_data changes since the last sync.")
+  parser.add_argument('state_file', nargs='?', default='user_sync_state.json')
+  parser.add_argument('--lag-seconds', type=float, default=DEFAULT_LAG_SECONDS,
+                      help="leave rows stamped this recently for the next run; must exceed the "
+                           f"longest write transaction (default {DEFAULT_LAG_SECONDS})")
+  parser.add_argument('--batch-size', type=int, default=1000)
+  parser.add_argument('--purge-tombstones', action='store_true',
+                      help="then delete the tombstones this state file has seen (single consumer only)")
+  args = parser.parse_args()
+
+  counts = {'upsert': 0, 'delete': 0}
+  for kind, _ in stream_user_changes(args.state_file, args.batch_size, args.lag_seconds):
+    counts[kind] += 1
+  print(f"{counts['upsert']} rows changed, {counts['delete']} rows deleted since the last sync.")
+  if args.purge_tombstones:
+    print(f"{purge_tombstones(args.state_file, args.batch_size)} tombstones purged.")
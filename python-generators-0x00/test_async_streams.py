@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+""" Tests for the read-ahead async generators of async_streams, on SQLite """
+import asyncio
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import unittest
+import uuid
+
+DEPENDENCIES = ('aiosqlite', 'mysql')  # seed imports mysql.connector
+
+
+def make_user_data(path, count):
+  """ create a user_data table of count users aged 20, 21, ... """
+  conn = sqlite3.connect(path)
+  conn.execute("CREATE TABLE user_data (user_id TEXT PRIMARY KEY, name TEXT NOT NULL, "
+               "email TEXT NOT NULL, age INTEGER NOT NULL)")
+  conn.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)",
+                   [(str(uuid.UUID(int=i + 1)), f"user{i}", f"user{i}@mail.com", 20 + i)
+                    for i in range(count)])
+  conn.commit()
+  conn.close()
+
+
+@unittest.skipIf(any(importlib.util.find_spec(name) is None for name in DEPENDENCIES),
+                 "aiosqlite and mysql-connector are required")
+class TestAsyncStreams(unittest.TestCase):
+  """ TESTCASE """
+
+  def setUp(self):
+    """ a backend on a table of 10 users that tracks its open connections """
+    import async_streams
+
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'users.db')
+    make_user_data(path, 10)
+    self.streams = async_streams
+    self.open_connections = 0
+    self.buffered = []
+    test = self
+
+    class TrackingBackend(async_streams.SQLiteBackend):
+      async def connect(self):
+        test.open_connections += 1
+        return await super().connect()
+
+      async def close(self, cnx):
+        test.open_connections -= 1
+        await super().close(cnx)
+
+      async def execute(self, cnx, query, params=(), dictionary=True, buffered=False):
+        test.buffered.append(buffered)
+        return await super().execute(cnx, query, params, dictionary, buffered)
+
+    self.backend = TrackingBackend(path)
+
+  def run_streams(self, make_stream, limit=None):
+    """ read up to limit items of each stream, then close it and check nothing is left running """
+    async def read(stream):
+      items = []
+      async for item in stream:
+        items.append(item)
+        if len(items) == limit:
+          break
+      await stream.aclose()
+      await asyncio.sleep(0)
+      return items, asyncio.all_tasks() - {asyncio.current_task()}
+
+    for prefetch in (0, 1, 3):
+      with self.subTest(prefetch=prefetch):
+        items, tasks = asyncio.run(read(make_stream(prefetch)))
+        self.assertEqual(tasks, set())
+        self.assertEqual(self.open_connections, 0)
+        yield items
+
+  def test_full_iteration(self):
+    """ every stream yields all users in order """
+    streams = self.streams
+    for items in self.run_streams(lambda prefetch: streams.async_stream_users(
+        batch_size=3, prefetch=prefetch, backend=self.backend)):
+      self.assertEqual([user['age'] for user in items], list(range(20, 30)))
+    for items in self.run_streams(lambda prefetch: streams.async_lazy_paginated_users(
+        4, prefetch=prefetch, backend=self.backend)):
+      self.assertEqual([user['name'] for user in items], [f"user{i}" for i in range(10)])
+    for items in self.run_streams(lambda prefetch: streams.async_stream_user_ages(
+        3, prefetch=prefetch, backend=self.backend)):
+      self.assertEqual(items, list(range(20, 30)))
+
+  def test_early_close(self):
+    """ closing a stream early stops its producer and closes the connection """
+    streams = self.streams
+    for items in self.run_streams(lambda prefetch: streams.async_stream_users(
+        batch_size=2, prefetch=prefetch, backend=self.backend), limit=3):
+      self.assertEqual(len(items), 3)
+    for items in self.run_streams(lambda prefetch: streams.async_lazy_paginated_users(
+        2, prefetch=prefetch, backend=self.backend), limit=1):
+      self.assertEqual(len(items), 1)
+    for items in self.run_streams(lambda prefetch: streams.async_stream_user_ages(
+        2, prefetch=prefetch, backend=self.backend), limit=5):
+      self.assertEqual(items, list(range(20, 25)))
+
+  def test_keyset_pages_are_buffered(self):
+    """ every keyset page is read with a buffered cursor, as they share one connection """
+    for items in self.run_streams(lambda prefetch: self.streams.async_lazy_paginated_users(
+        3, prefetch=prefetch, backend=self.backend)):
+      self.assertEqual(len(items), 10)
+    self.assertTrue(self.buffered)
+    self.assertTrue(all(self.buffered))
+
+  def test_producer_error(self):
+    """ an error reading a later batch reaches the consumer after the earlier batches """
+    backend = self.backend
+    original = type(backend).execute
+
+    class FailingCursor:
+      def __init__(self, cursor):
+        self.cursor = cursor
+        self.batches = 0
+
+      async def fetchmany(self, size):
+        self.batches += 1
+        if self.batches == 3:
+          raise sqlite3.OperationalError("disk I/O error")
+        return await self.cursor.fetchmany(size)
+
+    async def execute(cnx, query, params=(), dictionary=True, buffered=False):
+      return FailingCursor(await original(backend, cnx, query, params, dictionary, buffered))
+
+    backend.execute = execute
+
+    async def read(prefetch):
+      batches = []
+      with self.assertRaises(sqlite3.OperationalError):
+        async for batch in self.streams.async_stream_users_in_batches(
+            2, prefetch=prefetch, backend=backend):
+          batches.append(batch)
+      return batches
+
+    for prefetch in (0, 1, 3):
+      with self.subTest(prefetch=prefetch):
+        self.assertEqual(len(asyncio.run(read(prefetch))), 2)
+        self.assertEqual(self.open_connections, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+"""
+  Server-side projection, filtering and ordering for the user_data generators.
+
+  A UserQuery describes which columns to read, which rows to keep and in
+  which order, and renders it as a parameterized SELECT so MySQL does the
+  work: unused columns and rows never cross the wire, email predicates use
+  the UNIQUE email index, and values are always passed as parameters.
+  Column names cannot be parameters, so they are checked against a whitelist.
+
+  Example usage:
+    query = UserQuery(columns=('user_id', 'email'), min_age=25, email_prefix='ross')
+    for user in stream_users(query=query):
+      ...
+"""
+
+DEFAULT_COLUMNS = ('user_id', 'name', 'email', 'age')
+ALLOWED_COLUMNS = DEFAULT_COLUMNS + ('updated_at',)
+
+
+def _escape_like(value):
+  """Escape the LIKE wildcards in a literal prefix, using ! as the escape character."""
+  return value.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+class UserQuery:
+  """
+    Projection, predicates and ordering for a SELECT on user_data.
+
+    Args:
+      columns: Columns to return, in order (default user_id, name, email, age).
+      min_age, max_age: Inclusive age bounds.
+      email: Exact email match.
+      email_prefix: Emails starting with this text (an index range scan).
+      order_by: Column to sort by, or None for the table's natural order.
+      descending: Sort in descending order.
+  """
+
+  def __init__(self, columns=None, min_age=None, max_age=None, email=None,
+               email_prefix=None, order_by=None, descending=False):
+    columns = tuple(columns or DEFAULT_COLUMNS)
+    unknown = [column for column in columns if column not in ALLOWED_COLUMNS]
+    if unknown:
+      raise ValueError(f"Unknown user_data column(s): {', '.join(map(str, unknown))}")
+    if order_by is not None and order_by not in ALLOWED_COLUMNS:
+      raise ValueError(f"Cannot order by unknown column: {order_by!r}")
+    self.columns = columns
+    self.min_age = min_age
+    self.max_age = max_age
+    self.email = email
+    self.email_prefix = email_prefix
+    self.order_by = order_by
+    self.descending = descending
+
+  def project(self, *columns):
+    """Return a copy of this query returning only the given columns."""
+    return UserQuery(columns, self.min_age, self.max_age, self.email,
+                     self.email_prefix, self.order_by, self.descending)
+
+  def conditions(self):
+    """Return the WHERE conditions and their parameters as two lists."""
+    conditions = []
+    params = []
+    if self.min_age is not None:
+      conditions.append("age >= %s")
+      params.append(int(self.min_age))
+    if self.max_age is not None:
+      conditions.append("age <= %s")
+      params.append(int(self.max_age))
+    if self.email is not None:
+      conditions.append("email = %s")
+      params.append(self.email)
+    if self.email_prefix is not None:
+      # An explicit ESCAPE character behaves the same in MySQL and SQLite
+      conditions.append("email LIKE %s ESCAPE '!'")
+      params.append(_escape_like(self.email_prefix) + '%')
+    return conditions, params
+
+  def to_sql(self, conditions=(), params=(), order_by=None, limit=None, offset=None):
+    """
+      Render the query as ``(sql, params)``.
+
+      Args:
+        conditions, params: Extra conditions ANDed with the query's own, e.g.
+          a key range or a keyset seek, with their parameters.
+        order_by: Column overriding the query's ordering, always ascending
+          (e.g. user_id for keyset pagination).
+        limit, offset: Add parameterized LIMIT/OFFSET clauses.
+    """
+    own_conditions, own_params = self.conditions()
+    all_conditions = own_conditions + list(conditions)
+    all_params = own_params + list(params)
+
+    sql = f"SELECT {', '.join(self.columns)} FROM user_data"
+    if all_conditions:
+      sql += " WHERE " + " AND ".join(all_conditions)
+    if order_by is not None:
+      if order_by not in ALLOWED_COLUMNS:
+        raise ValueError(f"Cannot order by unknown column: {order_by!r}")
+      sql += f" ORDER BY {order_by}"
+    elif self.order_by is not None:
+      sql += f" ORDER BY {self.order_by}{' DESC' if self.descending else ''}"
+    if limit is not None:
+      sql += " LIMIT %s"
+      all_params.append(limit)
+      if offset is not None:
+        sql += " OFFSET %s"
+        all_params.append(offset)
+    return sql, tuple(all_params)
+
+  def user_id_index(self):
+    """Position of user_id in the projection, or None when it is not selected."""
+    return self.columns.index('user_id') if 'user_id' in self.columns else None
+
+  def __repr__(self):
+    return (f"UserQuery(columns={self.columns!r}, min_age={self.min_age!r}, max_age={self.max_age!r}, "
+            f"email={self.email!r}, email_prefix={self.email_prefix!r}, order_by={self.order_by!r}, "
+            f"descending={self.descending!r})")